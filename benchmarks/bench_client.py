@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+rancher.Client的吞吐和延迟基准测试，默认在进程内启动common.fake_km作为KM：
+    python benchmarks/bench_client.py --latency 0.005 --concurrency 8
+    python benchmarks/bench_client.py --url http://127.0.0.1:8080/v3 --token fake-token
+输出每个场景(list, by_id, create, wait_success, wait_state, bulk)的吞吐(ops/s)、p50/p99延迟(ms)和失败率，
+延迟只统计成功的调用
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common import rancher, comm  # noqa: E402
+from common.fake_km import FakeKM  # noqa: E402
+
+SCENARIOS = ('list', 'by_id', 'create', 'wait_success', 'wait_state', 'bulk')
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[int(round(q * (len(values) - 1)))]
+
+
+def run(fn, number, concurrency):
+    # 单次调用失败(例如--error-rate注入的错误重试后仍然失败)只计数，不中断整个场景
+    def timed(i):
+        start = time.perf_counter()
+        try:
+            fn(i)
+        except Exception as e:
+            return None, '{}: {}'.format(type(e).__name__, ' '.join(str(e).split())[:100])
+        return time.perf_counter() - start, None
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(timed, range(number)))
+    elapsed = time.perf_counter() - start
+    latencies = [t for t, _ in results if t is not None]
+    errors = [e for _, e in results if e is not None]
+    return {
+        'ops': number,
+        'errors': len(errors),
+        'error_rate': len(errors) / float(number),
+        'first_error': errors[0] if errors else None,
+        'throughput': len(latencies) / elapsed,
+        'p50': percentile(latencies, 0.5) * 1000,
+        'p99': percentile(latencies, 0.99) * 1000
+    }
+
+
+def scenarios(client, ids, bulk_size):
+    def create(i):
+        return client.create_namespace(name='bench-{}-{}'.format(i, random.randint(0, 1 << 30)))
+
+    return {
+        'list': lambda i: client.list_namespace(),
+        'by_id': lambda i: client.by_id_namespace(random.choice(ids)),
+        'create': create,
+        'wait_success': lambda i: client.wait_success(create(i)),
+        'wait_state': lambda i: comm.wait_for_source_state(
+            client, 'namespace', create(i).id, 'active'),
+        'bulk': lambda i: client.by_id_many('namespace', random.sample(ids, bulk_size))
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--url', help='KM url, default to an in-process fake KM')
+    parser.add_argument('--token')
+    parser.add_argument('--latency', type=float, default=0)
+    parser.add_argument('--jitter', type=float, default=0)
+    parser.add_argument('--error-rate', type=float, default=0)
+    parser.add_argument('--transition-delay', type=float, default=0.05)
+    parser.add_argument('--objects', type=int, default=200, help='namespaces preloaded for list/by_id')
+    parser.add_argument('--number', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--bulk-size', type=int, default=50)
+    parser.add_argument('--subscribe', action='store_true')
+    parser.add_argument('--scenario', action='append', choices=SCENARIOS)
+    parser.add_argument('--json', help='write results to this file')
+    args = parser.parse_args()
+
+    km = None
+    url, token = args.url, args.token
+    if url is None:
+        km = FakeKM(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                    transition_delay=args.transition_delay).start()
+        url, token = km.url, km.token
+        for i in range(args.objects):
+            km.add('namespace', {'name': 'preload-{}'.format(i)})
+
+    client = rancher.Client(url=url, token=token, verify=False, subscribe=args.subscribe)
+    ids = [ns.id for ns in client.iter_list('namespace')]
+    bulk_size = min(args.bulk_size, len(ids))
+    cases = scenarios(client, ids, bulk_size)
+
+    results = {}
+    print('{:<14} {:>6} {:>10} {:>10} {:>10} {:>8}'.format(
+        'scenario', 'ops', 'ops/s', 'p50(ms)', 'p99(ms)', 'errors'))
+    for name in args.scenario or SCENARIOS:
+        number = args.number if name not in ('wait_success', 'wait_state', 'bulk') \
+            else max(1, args.number // 10)
+        result = results[name] = run(cases[name], number, args.concurrency)
+        print('{:<14} {:>6} {:>10.1f} {:>10.2f} {:>10.2f} {:>7.1f}%'.format(
+            name, result['ops'], result['throughput'], result['p50'], result['p99'],
+            result['error_rate'] * 100))
+        if result['first_error']:
+            print('    first error: ' + result['first_error'])
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    if km is not None:
+        km.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+对比原有的json解码方式(object_pairs_hook + object_hook，sort_keys编码)与codec层的耗时
+payload可以是KM的json响应文件，或RANCHER_LOG_BODY_FILE记录的gzip jsonl文件，未指定时生成模拟的pod列表
+    python benchmarks/bench_codec.py [payload ...] [--number 20]
+"""
+import argparse
+import collections
+import gzip
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common import rancher  # noqa: E402
+from common.codec import CODECS, orjson  # noqa: E402
+
+
+class OfflineClient(rancher.Client):
+    # 只用于编解码，不加载schema
+    def _init_schemas(self):
+        pass
+
+
+def load_payloads(paths):
+    payloads = []
+    for path in paths:
+        if path.endswith('.gz'):
+            with gzip.open(path, 'rt', encoding='utf-8') as f:
+                for line in f:
+                    text = json.loads(line).get('response')
+                    if text and text.lstrip().startswith('{'):
+                        payloads.append(text)
+        else:
+            with open(path, encoding='utf-8') as f:
+                payloads.append(f.read())
+    return payloads
+
+
+def fake_payload(count=500):
+    base = 'https://km.example.com/v3/projects/c-abc:p-xyz/pods/'
+    data = []
+    for i in range(count):
+        pod_id = 'default:pod-{}'.format(i)
+        data.append({
+            'id': pod_id, 'type': 'pod', 'name': 'pod-{}'.format(i),
+            'namespaceId': 'default', 'state': 'running', 'transitioning': 'no',
+            'labels': {'app': 'demo', 'pod-template-hash': str(i)},
+            'containers': [{'name': 'demo', 'image': 'nginx:1.21',
+                            'ports': [{'containerPort': 80, 'protocol': 'TCP'}],
+                            'resources': {'limits': {'cpu': '500m'}}}],
+            'links': {'self': base + pod_id, 'remove': base + pod_id,
+                      'update': base + pod_id},
+            'actions': {}
+        })
+    return json.dumps({'type': 'collection', 'resourceType': 'pod',
+                       'pagination': {'limit': 1000, 'total': count},
+                       'data': data})
+
+
+class LegacyHooks(object):
+    """原有的解码方式：每个dict都转换为RestObject，并在解析时为每个link/action绑定闭包"""
+
+    def __init__(self, client):
+        self.client = client
+
+    def object_hook(self, obj):
+        if isinstance(obj, list):
+            return [self.object_hook(x) for x in obj]
+
+        if isinstance(obj, dict):
+            client = self.client
+            result = rancher.RestObject()
+
+            for k, v in obj.items():
+                setattr(result, k, self.object_hook(v))
+
+            for link in ['next', 'prev']:
+                try:
+                    url = getattr(result.pagination, link)
+                    if url is not None:
+                        setattr(result, link, lambda url=url: client._get(url))
+                except AttributeError:
+                    pass
+
+            if hasattr(result, 'type') and isinstance(getattr(result, 'type'), str):
+                if hasattr(result, 'links'):
+                    for link_name, link in result.links.items():
+                        def cb_link(_link=link, **kw):
+                            return client._get(_link, data=kw)
+
+                        if hasattr(result, link_name):
+                            setattr(result, link_name + '_link', cb_link)
+                        else:
+                            setattr(result, link_name, cb_link)
+
+                if hasattr(result, 'actions'):
+                    for link_name, link in result.actions.items():
+                        def cb_action(_link_name=link_name, _result=result,
+                                      *args, **kw):
+                            return client.action(_result, _link_name,
+                                                 *args, **kw)
+
+                        if hasattr(result, link_name):
+                            setattr(result, link_name + '_action', cb_action)
+                        else:
+                            setattr(result, link_name, cb_action)
+
+            return result
+
+        return obj
+
+    def object_pairs_hook(self, pairs):
+        ret = collections.OrderedDict()
+        for k, v in pairs:
+            ret[k] = v
+        return self.object_hook(ret)
+
+
+def legacy_to_value(value):
+    # 原有的递归实现
+    if isinstance(value, dict):
+        return {k: legacy_to_value(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [legacy_to_value(v) for v in value]
+    if isinstance(value, rancher.RestObject):
+        ret = {}
+        for k, v in vars(value).items():
+            if not k.startswith('_') and not callable(v):
+                ret[k] = legacy_to_value(v)
+        return ret
+    return value
+
+
+def legacy_loads(hooks, text):
+    return json.loads(text, object_hook=hooks.object_hook,
+                      object_pairs_hook=hooks.object_pairs_hook)
+
+
+def legacy_dumps(obj):
+    return json.dumps(legacy_to_value(obj), sort_keys=True)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('payloads', nargs='*')
+    parser.add_argument('--number', type=int, default=20)
+    args = parser.parse_args()
+
+    payloads = load_payloads(args.payloads) or [fake_payload()]
+    size = sum(len(p) for p in payloads)
+    print('{} payloads, {:.1f} KB'.format(len(payloads), size / 1024.0))
+
+    client = OfflineClient(subscribe=False, codec='json')
+    objs = [client._unmarshall(p) for p in payloads]
+    hooks = LegacyHooks(client)
+    cases = [('legacy', lambda p: legacy_loads(hooks, p), legacy_dumps)]
+    for name in CODECS:
+        if name == 'orjson' and orjson is None:
+            continue
+        c = OfflineClient(subscribe=False, codec=name)
+        cases.append((name, c._unmarshall, c._marshall))
+
+    print('{:<8} {:>12} {:>12}'.format('codec', 'loads(ms)', 'dumps(ms)'))
+    for name, loads, dumps in cases:
+        t_loads = timeit.timeit(lambda: [loads(p) for p in payloads],
+                                number=args.number) / args.number
+        t_dumps = timeit.timeit(lambda: [dumps(o) for o in objs],
+                                number=args.number) / args.number
+        print('{:<8} {:>12.2f} {:>12.2f}'.format(name, t_loads * 1000, t_dumps * 1000))
+
+
+if __name__ == '__main__':
+    main()
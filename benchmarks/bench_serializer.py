@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+对比原有的递归_to_dict/_to_value + json.dumps与serializer单次序列化请求体的耗时，
+数据为模拟的集群(完整的rancherKubernetesEngineConfig)和工作负载
+    python benchmarks/bench_serializer.py [--clusters 50] [--workloads 500] [--number 20]
+"""
+import argparse
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common import rancher, serializer  # noqa: E402
+from common.codec import CODECS, orjson  # noqa: E402
+
+
+class OfflineClient(rancher.Client):
+    # 只用于编解码，不加载schema
+    def _init_schemas(self):
+        pass
+
+
+def legacy_to_value(value):
+    # 原有的递归实现
+    if isinstance(value, dict):
+        return {k: legacy_to_value(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [legacy_to_value(v) for v in value]
+    if isinstance(value, rancher.RestObject):
+        ret = {}
+        for k, v in vars(value).items():
+            if not k.startswith('_') and \
+                    not isinstance(v, rancher.RestObject) and not callable(v):
+                ret[k] = legacy_to_value(v)
+            elif not k.startswith('_') and isinstance(v, rancher.RestObject):
+                ret[k] = legacy_to_dict(v)
+        return ret
+    return value
+
+
+def legacy_to_dict(*args, **kw):
+    if len(kw) == 0 and len(args) == 1 and isinstance(args[0], list):
+        return [legacy_to_dict(i) for i in args[0]]
+    ret = {}
+    for i in args:
+        value = legacy_to_value(i)
+        if isinstance(value, dict):
+            ret.update(value)
+    for k, v in kw.items():
+        ret[k] = legacy_to_value(v)
+    return ret
+
+
+def legacy_dumps(obj):
+    return json.dumps(legacy_to_dict(obj), sort_keys=True)
+
+
+def fake_cluster(i):
+    base = 'https://km.example.com/v3/clusters/c-{:05d}'.format(i)
+    nodes = [{'address': '10.0.{}.{}'.format(i % 250, n), 'user': 'root',
+              'role': ['etcd', 'controlplane', 'worker'], 'port': '22',
+              'labels': {'zone': 'z{}'.format(n % 3)}, 'taints': []}
+             for n in range(20)]
+    return {
+        'id': 'c-{:05d}'.format(i), 'type': 'cluster', 'name': 'cluster-{}'.format(i),
+        'state': 'active', 'transitioning': 'no', 'labels': {'env': 'test'},
+        'annotations': {'lifecycle.cattle.io/create.cluster-agent-controller': 'true'},
+        'rancherKubernetesEngineConfig': {
+            'type': 'rancherKubernetesEngineConfig',
+            'kubernetesVersion': 'v1.20.15-rancher1-1',
+            'nodes': nodes,
+            'network': {'plugin': 'canal', 'options': {'canal_iface': 'eth0'},
+                        'mtu': 0},
+            'services': {
+                'etcd': {'snapshot': True, 'retention': '72h', 'creation': '12h',
+                         'extraArgs': {'election-timeout': '5000',
+                                       'heartbeat-interval': '500'},
+                         'backupConfig': {'enabled': True, 'intervalHours': 12,
+                                          'retention': 6, 'safeTimestamp': False}},
+                'kubeApi': {'serviceClusterIpRange': '10.43.0.0/16',
+                            'serviceNodePortRange': '30000-32767',
+                            'extraArgs': {'feature-gates': 'x=true'},
+                            'auditLog': {'enabled': False}},
+                'kubeController': {'clusterCidr': '10.42.0.0/16',
+                                   'serviceClusterIpRange': '10.43.0.0/16'},
+                'kubelet': {'clusterDnsServer': '10.43.0.10',
+                            'clusterDomain': 'cluster.local',
+                            'extraBinds': ['/var/lib/kubelet:/var/lib/kubelet:shared']},
+            },
+            'ingress': {'provider': 'nginx', 'options': {}, 'nodeSelector': {}},
+            'addonJobTimeout': 45,
+        },
+        'links': {'self': base, 'update': base, 'remove': base,
+                  'nodes': base + '/nodes', 'projects': base + '/projects'},
+        'actions': {'exportYaml': base + '?action=exportYaml',
+                    'rotateCertificates': base + '?action=rotateCertificates'},
+    }
+
+
+def fake_workload(i):
+    base = 'https://km.example.com/v3/project/c-abc:p-xyz/workloads/deployment:default:w-{}'.format(i)
+    containers = [{
+        'type': 'container', 'name': 'c{}'.format(n), 'image': 'nginx:1.21',
+        'imagePullPolicy': 'IfNotPresent',
+        'ports': [{'type': 'containerPort', 'containerPort': 80 + n,
+                   'protocol': 'TCP', 'kind': 'ClusterIP'}],
+        'environment': {'KEY_{}'.format(e): 'value-{}'.format(e) for e in range(10)},
+        'resources': {'limits': {'cpu': '500m', 'memory': '512Mi'},
+                      'requests': {'cpu': '100m', 'memory': '128Mi'}},
+        'livenessProbe': {'tcp': False, 'port': 80, 'path': '/healthz',
+                          'initialDelaySeconds': 10, 'periodSeconds': 2},
+        'volumeMounts': [{'name': 'data', 'mountPath': '/data', 'readOnly': False}],
+    } for n in range(3)]
+    return {
+        'id': 'deployment:default:w-{}'.format(i), 'type': 'workload',
+        'name': 'w-{}'.format(i), 'namespaceId': 'default', 'scale': 3,
+        'labels': {'app': 'w-{}'.format(i)}, 'selector': {'matchLabels': {'app': 'w'}},
+        'containers': containers,
+        'volumes': [{'name': 'data', 'persistentVolumeClaim': {'claimName': 'pvc-{}'.format(i)}}],
+        'deploymentConfig': {'minReadySeconds': 0, 'strategy': 'RollingUpdate',
+                             'maxSurge': 1, 'maxUnavailable': 0},
+        'links': {'self': base, 'update': base, 'remove': base},
+        'actions': {'redeploy': base + '?action=redeploy', 'pause': base + '?action=pause'},
+    }
+
+
+def deep_object(client, depth):
+    # 超过递归深度限制的嵌套对象
+    value = client.object_hook({'type': 'node', 'leaf': True})
+    for _ in range(depth):
+        parent = client.object_hook({'type': 'node'})
+        parent.child = value
+        value = parent
+    return value
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--clusters', type=int, default=50)
+    parser.add_argument('--workloads', type=int, default=500)
+    parser.add_argument('--number', type=int, default=20)
+    parser.add_argument('--depth', type=int, default=5000)
+    args = parser.parse_args()
+
+    client = OfflineClient(subscribe=False, codec='json')
+    specs = [
+        ('clusters', [client.object_hook(fake_cluster(i)) for i in range(args.clusters)]),
+        ('workloads', [client.object_hook(fake_workload(i)) for i in range(args.workloads)]),
+    ]
+
+    cases = [('legacy', legacy_dumps)]
+    for name in CODECS:
+        if name == 'orjson' and orjson is None:
+            continue
+        c = OfflineClient(subscribe=False, codec=name)
+        cases.append((name, c._marshall))
+    cases.append(('write', serializer.write))
+
+    print('{:<10} {:<8} {:>10} {:>12}'.format('spec', 'method', 'dumps(ms)', 'speedup'))
+    for spec, objs in specs:
+        expected = json.loads(legacy_dumps(objs))
+        base = None
+        for name, dumps in cases:
+            assert json.loads(dumps(objs)) == expected, name
+            t = timeit.timeit(lambda: dumps(objs), number=args.number) / args.number
+            base = base or t
+            print('{:<10} {:<8} {:>10.2f} {:>11.2f}x'.format(spec, name, t * 1000, base / t))
+
+    deep = deep_object(client, args.depth)
+    try:
+        legacy_dumps(deep)
+        print('legacy: depth {} ok'.format(args.depth))
+    except RecursionError:
+        print('legacy: depth {} RecursionError'.format(args.depth))
+    text = client._marshall(deep)
+    print('serializer: depth {} ok, {} bytes'.format(args.depth, len(text)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import atexit
+import gzip
+import json
+import logging
+import os
+import queue
+import random
+import re
+import threading
+import time
+
+# 日志中请求/响应体的最大长度，超过的部分截断
+DEFAULT_BODY_LIMIT = int(os.environ.get('RANCHER_LOG_BODY_LIMIT') or 4096)
+# 记录请求/响应体的采样比例，0~1
+DEFAULT_SAMPLE_RATE = float(os.environ.get('RANCHER_LOG_SAMPLE_RATE') or 1)
+# 完整的请求/响应体异步写入的gzip文件(jsonl格式)
+DEFAULT_BODY_FILE = os.environ.get('RANCHER_LOG_BODY_FILE')
+# 写文件队列的长度，队列满时丢弃
+BODY_QUEUE_SIZE = 10000
+
+
+class LogPolicy(object):
+    """
+    rancher.Client请求日志的策略：
+    body_limit       日志中请求/响应体的最大长度
+    sample_rate      记录请求/响应体的采样比例
+    endpoint_levels  {url正则: 日志级别}，匹配的请求按该级别过滤，例如{'/schemas': logging.WARNING}
+    body_file        完整的请求/响应体异步写入的gzip文件
+    只有logger开启了对应级别时才会格式化日志内容
+    """
+
+    def __init__(self, body_limit=DEFAULT_BODY_LIMIT, sample_rate=DEFAULT_SAMPLE_RATE,
+                 endpoint_levels=None, body_file=DEFAULT_BODY_FILE):
+        self.body_limit = body_limit
+        self.sample_rate = sample_rate
+        self.endpoint_levels = [(re.compile(pattern), _level(level))
+                                for pattern, level in (endpoint_levels or {}).items()]
+        self.body_writer = BodyWriter(body_file) if body_file else None
+
+    def sampled(self):
+        return self.sample_rate >= 1 or random.random() < self.sample_rate
+
+    def enabled(self, logger, url, level):
+        for pattern, endpoint_level in self.endpoint_levels:
+            if pattern.search(url):
+                if level < endpoint_level:
+                    return False
+                break
+        return logger.isEnabledFor(level)
+
+    def truncate(self, text):
+        if not isinstance(text, str):
+            text = str(text)
+        if len(text) <= self.body_limit:
+            return text
+        return '{}... ({} chars truncated)'.format(text[:self.body_limit],
+                                                   len(text) - self.body_limit)
+
+    def write_body(self, method, url, data, r):
+        if self.body_writer is not None:
+            self.body_writer.write({
+                'time': time.time(),
+                'method': method,
+                'url': url,
+                'status': r.status_code,
+                'elapsed': r.elapsed.total_seconds(),
+                'request': data,
+                'response': r.text
+            })
+
+    def close(self):
+        if self.body_writer is not None:
+            self.body_writer.close()
+
+
+class BodyWriter(object):
+    """后台线程将请求/响应体写入gzip压缩的jsonl文件，不阻塞请求"""
+
+    def __init__(self, path):
+        self.path = path
+        self._queue = queue.Queue(maxsize=BODY_QUEUE_SIZE)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def write(self, record):
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            pass
+
+    def close(self):
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+
+    def _run(self):
+        dirname = os.path.dirname(self.path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        with gzip.open(self.path, 'at', encoding='utf-8') as f:
+            while True:
+                record = self._queue.get()
+                if record is None:
+                    return
+                f.write(json.dumps(record, ensure_ascii=False, default=str) + '\n')
+
+
+def _level(level):
+    if isinstance(level, str):
+        return logging.getLevelName(level.upper())
+    return level
+
+
+LOG_POLICY = LogPolicy()
+
+
+def configure_logging(**kw):
+    """
+    修改请求日志策略，参数同LogPolicy，例如：
+    configure_logging(body_limit=1024, sample_rate=0.1, endpoint_levels={'/pods': 'INFO'})
+    """
+    global LOG_POLICY
+    LOG_POLICY.close()
+    LOG_POLICY = LogPolicy(**kw)
+    return LOG_POLICY
+
+
+def get_policy():
+    return LOG_POLICY
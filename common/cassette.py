@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import datetime
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from urllib.parse import urlsplit, parse_qsl, urlencode
+
+import requests
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+
+# 录制/回放文件路径和模式：record录制，replay无延迟回放，timing按录制时的耗时回放
+PATH = os.environ.get('RANCHER_CASSETTE')
+MODE = os.environ.get('RANCHER_CASSETTE_MODE') or 'replay'
+RECORD, REPLAY, TIMING = 'record', 'replay', 'timing'
+# 录制时不保存的响应头，响应体保存的是解压后的内容
+SKIP_HEADERS = ('content-encoding', 'transfer-encoding', 'content-length', 'set-cookie')
+
+
+class CassetteMiss(Exception):
+    pass
+
+
+class Cassette(object):
+    """
+    请求/响应的录制和回放，保存在sqlite文件中，响应体zlib压缩，按请求的key建立索引。
+    回放时按method、url(忽略host，查询参数排序)和规范化后的请求体匹配，
+    请求体不一致时(例如随机的资源名)退化为只按method和url匹配。
+    相同请求的多次响应按录制顺序依次返回，用完后重复返回最后一次的响应
+    """
+
+    def __init__(self, path, mode=REPLAY):
+        if mode not in (RECORD, REPLAY, TIMING):
+            raise ValueError('unknown cassette mode: {}'.format(mode))
+        if mode != RECORD and not os.path.isfile(path):
+            raise IOError('cassette {} not found'.format(path))
+        dirname = os.path.dirname(path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        self.path = path
+        self.mode = mode
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        if mode == RECORD:
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS interactions ('
+                'id INTEGER PRIMARY KEY AUTOINCREMENT, key TEXT, loose_key TEXT, '
+                'method TEXT, url TEXT, status INTEGER, reason TEXT, '
+                'headers TEXT, body BLOB, elapsed REAL)')
+            self._db.execute('CREATE INDEX IF NOT EXISTS ix_key ON interactions (key)')
+            self._db.execute('CREATE INDEX IF NOT EXISTS ix_loose_key ON interactions (loose_key)')
+            self._db.commit()
+
+    @property
+    def replaying(self):
+        return self.mode != RECORD
+
+    def record(self, request, response, elapsed):
+        key, loose_key = _keys(request)
+        headers = {k: v for k, v in response.headers.items()
+                   if k.lower() not in SKIP_HEADERS}
+        with self._lock:
+            self._db.execute(
+                'INSERT INTO interactions (key, loose_key, method, url, status, reason, '
+                'headers, body, elapsed) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (key, loose_key, request.method, request.url, response.status_code,
+                 response.reason, json.dumps(headers),
+                 zlib.compress(response.content or b''), elapsed))
+            self._db.commit()
+
+    def play(self, request):
+        key, loose_key = _keys(request)
+        with self._lock:
+            row = self._next('key', key) or self._next('loose_key', loose_key)
+        if row is None:
+            raise CassetteMiss('no recorded response for {} {}'.format(
+                request.method, request.url))
+        status, reason, headers, body, elapsed = row
+        response = requests.Response()
+        response.status_code = status
+        response.reason = reason
+        response.headers = CaseInsensitiveDict(json.loads(headers))
+        response._content = zlib.decompress(body)
+        response.encoding = requests.utils.get_encoding_from_headers(response.headers) or 'utf-8'
+        response.url = request.url
+        response.request = request
+        if self.mode == TIMING:
+            time.sleep(elapsed)
+        response.elapsed = datetime.timedelta(seconds=elapsed if self.mode == TIMING else 0)
+        return response
+
+    def _next(self, column, key):
+        counter = (column, key)
+        index = self._counters.get(counter, 0)
+        query = 'SELECT status, reason, headers, body, elapsed FROM interactions ' \
+                'WHERE {} = ? ORDER BY id LIMIT 1 OFFSET ?'.format(column)
+        row = self._db.execute(query, (key, index)).fetchone()
+        if row is None and index > 0:
+            row = self._db.execute(query, (key, index - 1)).fetchone()
+        if row is not None:
+            self._counters[counter] = index + 1
+        return row
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class CassetteAdapter(BaseAdapter):
+    """挂载到Session上，录制模式下转发给原来的adapter并保存响应，回放模式下不发起请求"""
+
+    def __init__(self, cassette, adapter):
+        super(CassetteAdapter, self).__init__()
+        self.cassette = cassette
+        self.adapter = adapter
+
+    def send(self, request, **kw):
+        if self.cassette.replaying:
+            return self.cassette.play(request)
+        start = time.time()
+        response = self.adapter.send(request, **kw)
+        response.content
+        self.cassette.record(request, response, time.time() - start)
+        return response
+
+    def close(self):
+        self.adapter.close()
+
+
+def _keys(request):
+    parts = urlsplit(request.url)
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    loose_key = '{} {}?{}'.format(request.method, parts.path, query)
+    body = _normalize_body(request)
+    if not body:
+        return loose_key, loose_key
+    return loose_key + ' ' + hashlib.sha1(body).hexdigest(), loose_key
+
+
+def _normalize_body(request):
+    body = request.body
+    if body is None:
+        return b''
+    if isinstance(body, str):
+        body = body.encode('utf-8')
+    if not isinstance(body, bytes):
+        # 文件流等无法重复读取的请求体只按url匹配
+        return b''
+    try:
+        return json.dumps(json.loads(body), sort_keys=True,
+                          separators=(',', ':')).encode('utf-8')
+    except ValueError:
+        pass
+    # multipart的boundary每次都不同
+    content_type = request.headers.get('Content-Type', '')
+    match = re.search(r'boundary=([^;]+)', content_type)
+    if match:
+        body = body.replace(match.group(1).encode('utf-8'), b'')
+    return body
+
+
+_CASSETTE = None
+_CASSETTE_LOCK = threading.Lock()
+
+
+def configure(path, mode=REPLAY):
+    """开启录制/回放，path为None时关闭"""
+    global _CASSETTE
+    with _CASSETTE_LOCK:
+        if _CASSETTE is not None:
+            _CASSETTE.close()
+        _CASSETTE = Cassette(path, mode) if path else None
+        return _CASSETTE
+
+
+def get_cassette():
+    global _CASSETTE
+    if _CASSETTE is None and PATH:
+        with _CASSETTE_LOCK:
+            if _CASSETTE is None:
+                _CASSETTE = Cassette(PATH, MODE)
+    return _CASSETTE
+
+
+def replaying():
+    cassette = get_cassette()
+    return cassette is not None and cassette.replaying
+
+
+def mount(session):
+    """开启录制/回放时，将session的http/https adapter包装为CassetteAdapter"""
+    cassette = get_cassette()
+    if cassette is None:
+        return session
+    for prefix in ('https://', 'http://'):
+        session.mount(prefix, CassetteAdapter(cassette, session.get_adapter(prefix)))
+    return session
+
+
+def post(url, **kw):
+    """替代requests.post，例如conftest中的登录请求"""
+    with mount(requests.Session()) as session:
+        return session.post(url, **kw)
+
+
+def skip_sleep():
+    """回放模式下等待函数不sleep，轮询可以立即结束；计时模式仍然按原来的间隔等待"""
+    cassette = get_cassette()
+    return cassette is not None and cassette.mode == REPLAY
+
+
+def sleep(seconds):
+    """等待函数使用的sleep，回放模式下直接返回"""
+    if skip_sleep():
+        return
+    time.sleep(seconds)
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import threading
+import weakref
+
+# 不记录原始数据的资源类型
+UNTRACKED_TYPES = frozenset(('schema', 'collection'))
+
+
+class ChangeTracker(object):
+    """
+    记录资源解析时的原始数据(json解码后的dict，不复制)，update时与当前数据比较，只发送修改过的字段。
+    资源被回收后记录自动删除
+    """
+
+    def __init__(self):
+        self._originals = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def track(self, obj, original):
+        with self._lock:
+            self._originals[obj] = original
+
+    def original(self, obj):
+        try:
+            with self._lock:
+                return self._originals.get(obj)
+        except TypeError:
+            # 不支持弱引用的对象
+            return None
+
+
+def diff(old, new):
+    """
+    JSON merge patch(RFC 7386)：new相对old修改过的字段，dict递归比较，删除的字段为None，
+    list和标量整体替换
+    """
+    patch = {}
+    for k, v in new.items():
+        if k not in old:
+            patch[k] = v
+            continue
+        o = old[k]
+        if o == v:
+            continue
+        if isinstance(o, dict) and isinstance(v, dict):
+            patch[k] = diff(o, v)
+        else:
+            patch[k] = v
+    for k in old:
+        if k not in new:
+            patch[k] = None
+    return patch
+
+
+def merge(target, patch):
+    """将merge patch应用到target上，返回新的值，不修改target"""
+    if not isinstance(patch, dict):
+        return patch
+    result = dict(target) if isinstance(target, dict) else {}
+    for k, v in patch.items():
+        if v is None:
+            result.pop(k, None)
+        else:
+            result[k] = merge(result.get(k), v)
+    return result
+
+
+def body(current, patch, explicit):
+    """
+    update的请求体：只包含修改过的顶层字段，current为本地数据(首次请求)或重新获取的数据(409之后)，
+    修改过的字段在current对应字段的基础上应用patch，explicit中的字段直接覆盖
+    """
+    ret = {}
+    for k, v in patch.items():
+        if v is None:
+            ret[k] = None
+        elif isinstance(v, dict):
+            ret[k] = merge(current.get(k), v)
+        else:
+            ret[k] = v
+    ret.update(explicit)
+    return ret
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import json
+import os
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# 指定json编解码实现：json/orjson，默认安装了orjson时使用orjson
+CODEC = os.environ.get('RANCHER_JSON_CODEC')
+
+
+class JsonCodec(object):
+    """标准库json，解析结果为普通的dict/list"""
+    name = 'json'
+
+    def loads(self, text):
+        return json.loads(text)
+
+    def dumps(self, obj, indent=None, sort_keys=False, default=None):
+        return json.dumps(obj, indent=indent, sort_keys=sort_keys, default=default)
+
+
+class OrjsonCodec(JsonCodec):
+    """
+    orjson，不支持的输入(NaN、超过64位的整数、indent不为2等)回退到标准库json
+    dumps返回str，与标准库保持一致
+    """
+    name = 'orjson'
+
+    def loads(self, text):
+        try:
+            return orjson.loads(text)
+        except orjson.JSONDecodeError:
+            return json.loads(text)
+
+    def dumps(self, obj, indent=None, sort_keys=False, default=None):
+        if indent not in (None, 2):
+            return json.dumps(obj, indent=indent, sort_keys=sort_keys, default=default)
+        option = orjson.OPT_NON_STR_KEYS
+        if indent == 2:
+            option |= orjson.OPT_INDENT_2
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        try:
+            return orjson.dumps(obj, default=default, option=option).decode('utf-8')
+        except TypeError:
+            return json.dumps(obj, indent=indent, sort_keys=sort_keys, default=default)
+
+
+CODECS = {
+    'json': JsonCodec,
+    'orjson': OrjsonCodec
+}
+
+
+def get_codec(codec=None):
+    """
+    codec可以是编解码对象、名称(json/orjson)或None，
+    None时使用RANCHER_JSON_CODEC，未设置时安装了orjson则使用orjson
+    """
+    if codec is not None and not isinstance(codec, str):
+        return codec
+    name = codec or CODEC
+    if name is None:
+        name = 'json' if orjson is None else 'orjson'
+    if name == 'orjson' and orjson is None:
+        raise ImportError('orjson is not installed')
+    return CODECS[name]()
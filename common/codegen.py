@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+根据KM /v3 schema生成静态的客户端模块：每个type一个包含resourceActions对应方法的类型类，
+显式的list_/by_id_/create_/update_by_id_方法，以及加载该模块的Client/AsyncClient。
+字段仍保存在资源实例的属性字典中，字段元数据只保留在SCHEMAS中，不生成字段访问器。
+生成的模块是稳定的文本，可以在KM版本之间diff：
+    python -m common.codegen --url https://<km>/v3 --token <token> -o common/km_v3.py
+    python -m common.codegen --schema schemas.json --server-version v2.5.7 -o common/km_v3.py
+使用：
+    from common.km_v3 import Client
+    client = Client(url=BASE_URL, token=token)
+或者 RANCHER_SCHEMA_MODULE=common.km_v3，rancher.Client在KM版本一致时使用该模块，不再请求schema
+"""
+import argparse
+import hashlib
+import json
+import keyword
+import pprint
+import re
+import sys
+from urllib.parse import urlsplit
+
+import requests
+
+from common import rancher
+
+# 生成的模块中保留的schema字段，Client只用到这些字段
+SCHEMA_KEYS = ('id', 'type', 'pluralName', 'links', 'collectionMethods', 'resourceMethods',
+               'collectionFilters', 'collectionActions', 'resourceActions', 'resourceFields')
+# 保留的字段元数据
+FIELD_KEYS = ('type', 'nullable', 'required', 'create', 'update', 'default', 'options',
+              'min', 'max', 'minLength', 'maxLength')
+RESERVED_NAMES = ('Methods', 'Client', 'AsyncClient', 'rancher', 'sys')
+
+HEADER = '''# -*- coding: utf-8 -*-
+"""
+由common/codegen.py根据KM schema生成，不要手动修改，KM升级后重新生成：
+    python -m common.codegen --url https://<km>{path} --token <token> -o <module>.py
+"""
+import sys
+
+from common import rancher
+
+SCHEMA_PATH = {path!r}
+SERVER_VERSION = {version!r}
+SCHEMA_HASH = {hash!r}
+
+SCHEMAS = {schemas}
+'''
+
+CLIENTS = '''
+
+
+class Client(Methods, rancher.Client):
+    def __init__(self, *args, **kw):
+        kw.setdefault('schema_module', sys.modules[__name__])
+        super(Client, self).__init__(*args, **kw)
+
+
+class AsyncClient(Methods, rancher.AsyncClient):
+    def __init__(self, *args, **kw):
+        kw.setdefault('schema_module', sys.modules[__name__])
+        super(AsyncClient, self).__init__(*args, **kw)
+'''
+
+METHODS = {
+    'list': ('self, **kw', "self.list({type!r}, **kw)"),
+    'by_id': ('self, id, **kw', "self.by_id({type!r}, id, **kw)"),
+    'update_by_id': ('self, id, *args, **kw', "self.update_by_id({type!r}, id, *args, **kw)"),
+    'create': ('self, *args, **kw', "self.create({type!r}, *args, **kw)"),
+}
+
+
+def fetch(url, token=None, verify=True):
+    """返回(schema数据, server-version)"""
+    headers = {'Accept': 'application/json'}
+    if token:
+        headers['Authorization'] = 'Bearer ' + token
+    with requests.Session() as session:
+        session.headers.update(headers)
+        session.verify = verify
+        r = session.get(url)
+        r.raise_for_status()
+        schema_url = r.headers.get('X-API-Schemas')
+        if schema_url and schema_url != url:
+            r = session.get(schema_url)
+            r.raise_for_status()
+        data = r.json()
+        parts = urlsplit(url)
+        version = None
+        version_url = '{}://{}{}'.format(parts.scheme, parts.netloc, rancher.SERVER_VERSION_PATH)
+        r = session.get(version_url)
+        if r.status_code == 200:
+            version = r.json().get('value')
+    return data, version
+
+
+def normalize(data):
+    """只保留Client用到的schema字段，links去掉host，按id排序"""
+    if isinstance(data, dict):
+        data = data.get('data', [])
+    schemas = []
+    for schema in data:
+        if schema.get('type') != 'schema':
+            continue
+        item = {k: schema[k] for k in SCHEMA_KEYS if k in schema}
+        links = schema.get('links') or {}
+        item['links'] = {k: urlsplit(links[k]).path for k in ('collection', 'self')
+                         if links.get(k)}
+        fields = schema.get('resourceFields') or {}
+        item['resourceFields'] = {
+            name: {k: field[k] for k in FIELD_KEYS if k in field}
+            for name, field in fields.items()}
+        schemas.append(item)
+    return sorted(schemas, key=lambda s: s['id'])
+
+
+def schema_hash(schemas):
+    text = json.dumps(schemas, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def class_name(type_name, taken):
+    name = re.sub(r'\W', '_', type_name)
+    name = name[:1].upper() + name[1:]
+    if not name.isidentifier() or keyword.iskeyword(name):
+        name = 'T_' + name
+    while name in taken or name in RESERVED_NAMES:
+        name += '_'
+    taken.add(name)
+    return name
+
+
+def generate(data, path='/v3', version=None):
+    """返回生成的模块源码，data为/v3/schemas的响应或其中的data列表"""
+    schemas = normalize(data)
+    out = [HEADER.format(path=path, version=version, hash=schema_hash(schemas),
+                         schemas=pprint.pformat(schemas, width=100))]
+
+    taken = set()
+    types = []
+    for schema in schemas:
+        name = class_name(schema['id'], taken)
+        types.append((schema['id'], name))
+        out.append('\n\nclass {}(object):'.format(name))
+        # 只有方法，由Client复制到资源的布局类上，类本身不会被实例化
+        out.append('    """{} resourceActions"""'.format(schema['id']))
+        for action in sorted(schema.get('resourceActions') or {}):
+            if not action.isidentifier() or keyword.iskeyword(action) or \
+                    action.startswith('_'):
+                continue
+            out.append('')
+            out.append('    def {}(self, *args, **kw):'.format(action))
+            out.append('        return self._client.action(self, {!r}, *args, **kw)'.format(action))
+
+    out.append('\n\nTYPES = {')
+    for type_name, name in types:
+        out.append('    {!r}: {},'.format(type_name, name))
+    out.append('}')
+
+    out.append('\n\nclass Methods(object):')
+    out.append('    """每个type的list_/by_id_/create_/update_by_id_方法，与rancher.Client按schema生成的方法一致"""')
+    for schema in schemas:
+        type_name = schema['id']
+        variants = rancher.Client._type_name_variants(type_name)
+        for method_name, type_collection, test_method in rancher.BINDINGS:
+            if test_method not in schema.get(type_collection, []):
+                continue
+            names = ['_'.join([method_name, v]) for v in variants]
+            names = [n for n in names if n.isidentifier() and not keyword.iskeyword(n)]
+            if not names:
+                continue
+            params, call = METHODS[method_name]
+            out.append('')
+            out.append('    def {}({}):'.format(names[-1], params))
+            out.append('        return ' + call.format(type=type_name))
+            for alias in names[:-1]:
+                out.append('')
+                out.append('    {} = {}'.format(alias, names[-1]))
+    return '\n'.join(out) + CLIENTS
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='generate a static client module from KM schema')
+    parser.add_argument('--url', help='KM api url, e.g. https://<km>/v3')
+    parser.add_argument('--token')
+    parser.add_argument('--insecure', action='store_true')
+    parser.add_argument('--schema', help='/v3/schemas response saved as json, instead of --url')
+    parser.add_argument('--server-version', help='KM server version of --schema')
+    parser.add_argument('--path', default='/v3', help='api path of --schema')
+    parser.add_argument('-o', '--output', help='output file, default stdout')
+    args = parser.parse_args(argv)
+
+    if args.schema:
+        with open(args.schema, encoding='utf-8') as f:
+            data = json.load(f)
+        version = args.server_version
+        path = args.path
+    elif args.url:
+        data, version = fetch(args.url, args.token, not args.insecure)
+        version = args.server_version or version
+        path = urlsplit(args.url).path.rstrip('/')
+    else:
+        parser.error('--url or --schema is required')
+
+    source = generate(data, path, version)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(source)
+    else:
+        sys.stdout.write(source)
+
+
+if __name__ == '__main__':
+    main()
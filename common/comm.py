@@ -1,8 +1,12 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 import time
+import threading
+from concurrent.futures import Future
 from functools import wraps
-from common.rancher import RestObject
+from common.rancher import RestObject, ApiError, ClientApiError, DEADLINE_ERRORS
+from common.deadline import deadline
+from common import cassette
 
 
 DEFAULT_TIMEOUT = 60
@@ -22,7 +26,7 @@ def wait_for(callback, timeout=DEFAULT_TIMEOUT, fail_handler=None):
     start = time.time()
     ret = callback()
     while ret is None or ret is False:
-        time.sleep(next(sleep_time))
+        cassette.sleep(next(sleep_time))
         if time.time() - start > timeout:
             exception_msg = 'Timeout waiting for condition.'
             if fail_handler:
@@ -35,20 +39,26 @@ def wait_for(callback, timeout=DEFAULT_TIMEOUT, fail_handler=None):
 
 def wait_for_condition(condition_type, status, client, obj, timeout=45):
     start = time.time()
-    obj = client.reload(obj)
-    sleep = 0.01
-    while not find_condition(condition_type, status, obj):
-        time.sleep(sleep)
-        sleep *= 2
-        if sleep > 2:
-            sleep = 2
-        obj = client.reload(obj)
-        delta = time.time() - start
-        if delta > timeout:
+    # 在deadline中等待，client的每个请求都不会超过剩余时间
+    with deadline(timeout) as d:
+        try:
+            watch = client.watch(obj.type, obj.id)
+            obj = client.reload(obj)
+            sleep = 0.01
+            while not find_condition(condition_type, status, obj):
+                d.check()
+                obj = client.wait_change(obj.type, obj.id, watch, sleep)
+                sleep *= 2
+                if sleep > 2:
+                    sleep = 2
+        except DEADLINE_ERRORS:
+            # 请求因deadline到期失败时，抛出说明等待条件的超时异常
+            if not d.expired():
+                raise
             msg = 'Expected condition {} to have status {}\n' \
                   'Timeout waiting for [{}:{}] for condition after {} ' \
                   'seconds\n {}'.format(condition_type, status, obj.type, obj.id,
-                                        delta, str(obj))
+                                        time.time() - start, str(obj))
             raise Exception(msg)
     return obj
 
@@ -97,7 +107,7 @@ def retry(func, dest, timeout=60, msg='', *args, **kwargs):
     while func(*args, **kwargs) != dest:
         if time.time() - start > timeout:
             raise Exception('Timeout waiting ' + msg)
-        time.sleep(interval)
+        cassette.sleep(interval)
         interval = 2 * interval if interval < 5 else 5
 
     return True
@@ -112,7 +122,7 @@ def retry2(func, dest, timeout=30, msg='', *args, **kwargs):
     while func(*args, **kwargs) != dest:
         if time.time() - start > timeout:
             return False
-        time.sleep(interval)
+        cassette.sleep(interval)
 
     return True
 
@@ -128,7 +138,7 @@ def wait_until(cb, timeout=DEFAULT_TIMEOUT, backoff=True):
     while time.time() < start_time + timeout and cb() is False:
         # if backoff:
         #     interval *= 2
-        time.sleep(interval)
+        cassette.sleep(interval)
         interval = 2 * interval if interval < 5 else 5
     if time.time() > start_time + timeout and cb() is False:
         raise Exception('timeout waiting')
@@ -162,7 +172,7 @@ def calculate_func_run_time(func):
 def check_resource_in_list(resource_list, resource):
     """
     判断资源列表中是否存在要查找的资源
-    :param resource_list: 资源列表
+    :param resource_list: 资源列表，也可以是client.iter_list返回的迭代器，找到后不再请求后续的页
     :param resource: 目标资源
     :return:
     """
@@ -205,17 +215,169 @@ def wait_for_source_state(client, source_type, source_id, state, timeout=120):
     :param timeout: 等待超时时间
     :return: 返回状态更新后的资源
     """
-    start = time.time()
     interval = 0.5
     updated = False
-    while not updated:
-        if time.time() - start > timeout:
+    with deadline(timeout) as d:
+        try:
+            watch = client.watch(source_type, source_id)
+            reload_source = client.by_id(source_type, source_id)
+            while not updated:
+                d.check()
+                if reload_source.state == state:
+                    return reload_source
+                reload_source = client.wait_change(source_type, source_id, watch, interval)
+                interval = 2 * interval if interval < 5 else 5
+        except DEADLINE_ERRORS:
+            if not d.expired():
+                raise
             raise Exception('Timeout waiting for state to update')
-        reload_source = client.by_id(source_type, source_id)
-        if reload_source.state == state:
-            return reload_source
-        time.sleep(interval)
-        interval = 2 * interval if interval < 5 else 5
+
+
+def wait_for_sources_state(client, source_type, source_ids, state, timeout=120, interval=2):
+    """
+    批量等待多个资源的状态改变，每个间隔只请求一次资源列表
+    :param client: admin用户
+    :param source_type: 资源类型
+    :param source_ids: 资源的id列表
+    :param state: 期望的状态
+    :param timeout: 等待超时时间
+    :param interval: 请求间隔
+    :return: 返回与source_ids顺序一致的状态更新后的资源
+    """
+    scheduler = WaitScheduler(client, interval=interval)
+    try:
+        futures = [scheduler.register(source_type, source_id,
+                                      lambda res: res is not None and res.state == state,
+                                      timeout=timeout)
+                   for source_id in source_ids]
+        return [f.result() for f in futures]
+    finally:
+        scheduler.close()
+
+
+class WaitScheduler(object):
+    """
+    批量轮询调度器：注册(type, id, predicate, timeout)后返回Future，
+    后台线程每个interval对同一type(及相同过滤条件)的所有等待者只发一次列表请求(id_in过滤)，
+    predicate(资源)为真时Future返回该资源，资源不存在时predicate的参数为None，超时时Future抛出异常。
+    """
+
+    def __init__(self, client, interval=2, use_id_filter=True):
+        self._client = client
+        self._interval = interval
+        self._use_id_filter = use_id_filter
+        self._waiters = {}
+        self._lock = threading.Lock()
+        # 没有等待者时后台线程在_idle上等待register/close，不空转
+        self._idle = threading.Condition(self._lock)
+        self._wakeup = threading.Event()
+        self._closed = False
+        self._thread = None
+
+    def register(self, source_type, source_id, predicate, timeout=DEFAULT_TIMEOUT, **filters):
+        """
+        :param source_type: 资源类型
+        :param source_id: 资源id
+        :param predicate: 判断条件，参数为资源或None(资源不存在)
+        :param timeout: 等待超时时间
+        :param filters: 列表请求的过滤条件，例如clusterId，相同过滤条件的等待者合并为一次请求
+        """
+        future = Future()
+        key = (source_type, tuple(sorted(filters.items())))
+        waiter = (source_id, predicate, time.time() + timeout, future)
+        with self._lock:
+            if self._closed:
+                raise RuntimeError('WaitScheduler is closed')
+            self._waiters.setdefault(key, []).append(waiter)
+            self._idle.notify()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+        return future
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            waiters, self._waiters = self._waiters, {}
+            self._idle.notify_all()
+        self._wakeup.set()
+        for group in waiters.values():
+            for _, _, _, future in group:
+                future.cancel()
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while not self._closed and not self._waiters:
+                    self._idle.wait()
+                if self._closed:
+                    return
+                groups = {k: list(v) for k, v in self._waiters.items()}
+            for key, waiters in groups.items():
+                self._tick(key, waiters)
+            # 回放时不等待，轮询立即进入下一轮，与cassette.sleep一致
+            if not cassette.skip_sleep():
+                self._wakeup.wait(self._interval)
+
+    def _tick(self, key, waiters):
+        source_type, filters = key
+        ids = sorted(set(str(w[0]) for w in waiters))
+        try:
+            sources = self._list(source_type, ids, dict(filters))
+        except Exception as e:
+            sources = None
+            error = e
+
+        done = []
+        now = time.time()
+        for waiter in waiters:
+            source_id, predicate, deadline, future = waiter
+            if future.done():
+                done.append(waiter)
+                continue
+            if sources is not None:
+                source = sources.get(str(source_id))
+                try:
+                    if predicate(source):
+                        future.set_result(source)
+                        done.append(waiter)
+                        continue
+                except Exception as e:
+                    future.set_exception(e)
+                    done.append(waiter)
+                    continue
+            if now > deadline:
+                msg = 'Timeout waiting for [{}:{}]'.format(source_type, source_id)
+                if sources is None:
+                    msg += ', last error: {}'.format(error)
+                future.set_exception(Exception(msg))
+                done.append(waiter)
+
+        with self._lock:
+            remaining = [w for w in self._waiters.get(key, []) if w not in done]
+            if remaining:
+                self._waiters[key] = remaining
+            else:
+                self._waiters.pop(key, None)
+
+    def _list(self, source_type, ids, filters):
+        if self._use_id_filter:
+            try:
+                return self._index(self._client.iter_list(source_type, prefetch=0,
+                                                          id_in=ids, **filters))
+            except ClientApiError:
+                # strict模式下id_in不是可过滤的字段
+                self._use_id_filter = False
+            except ApiError as e:
+                # 不支持id_in过滤时退回到只按filters请求
+                if e.error.status not in (400, 422):
+                    raise e
+                self._use_id_filter = False
+        return self._index(self._client.iter_list(source_type, prefetch=0, **filters))
+
+    @staticmethod
+    def _index(sources):
+        return {str(source.id): source for source in sources}
 
 
 def wait_for_source_build_success(client, source_type, source_id, build_timeout=300):
@@ -223,27 +385,31 @@ def wait_for_source_build_success(client, source_type, source_id, build_timeout=
     等待资源创建或者更新完成：某些资源创建或者更新后资源状态变化为：active->...->active
     """
     is_status_change = False
-    start = time.time()
+    watch = client.watch(source_type, source_id)
+    res = client.by_id(source_type, source_id)
     # 短暂时间内state是active
-    while not is_status_change:
-        if time.time() - start > 10:
-            raise AssertionError(
-                "Timed out waiting for source status change ")
-        res = client.by_id(source_type, source_id)
-        if res.state != "active":
-            is_status_change = True
-            continue
-        time.sleep(2)
-    start = time.time()
+    try:
+        with deadline(10) as d:
+            while not is_status_change:
+                d.check()
+                if res.state != "active":
+                    is_status_change = True
+                    continue
+                res = client.wait_change(source_type, source_id, watch, 2)
+    except DEADLINE_ERRORS:
+        raise AssertionError(
+            "Timed out waiting for source status change ")
     is_build_success = False
-    while not is_build_success:
-        if time.time() - start > build_timeout:
-            raise AssertionError(
-                "Timed out waiting for build source")
-        res = client.by_id(source_type, source_id)
-        if res.state == "active":
-            is_build_success = True
-            continue
-        time.sleep(5)
+    try:
+        with deadline(build_timeout) as d:
+            while not is_build_success:
+                d.check()
+                if res.state == "active":
+                    is_build_success = True
+                    continue
+                res = client.wait_change(source_type, source_id, watch, 5)
+    except DEADLINE_ERRORS:
+        raise AssertionError(
+            "Timed out waiting for build source")
     assert is_build_success is True
 
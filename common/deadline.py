@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import contextlib
+import contextvars
+import time
+
+_DEADLINE = contextvars.ContextVar('rancher_deadline', default=None)
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class Deadline(object):
+    def __init__(self, timeout):
+        self.timeout = timeout
+        self.expires = time.monotonic() + timeout
+
+    def remaining(self):
+        return self.expires - time.monotonic()
+
+    def expired(self):
+        return self.remaining() <= 0
+
+    def check(self):
+        if self.expired():
+            raise DeadlineExceeded(
+                'Deadline of {} seconds exceeded'.format(self.timeout))
+
+
+@contextlib.contextmanager
+def deadline(timeout):
+    """
+    设置当前上下文的截止时间，嵌套时取更早的截止时间，例如：
+        with deadline(60):
+            client.wait_success(obj, timeout=120)  # 最多等待60秒
+    Client的每个请求的超时不会超过剩余时间
+    """
+    current = _DEADLINE.get()
+    new = Deadline(timeout)
+    if current is not None and current.expires <= new.expires:
+        new = current
+    token = _DEADLINE.set(new)
+    try:
+        yield new
+    finally:
+        _DEADLINE.reset(token)
+
+
+def current():
+    return _DEADLINE.get()
+
+
+def remaining(default=None):
+    """当前上下文的剩余时间，没有截止时间时返回default"""
+    d = _DEADLINE.get()
+    if d is None:
+        return default
+    return d.remaining()
+
+
+def cap(value):
+    """将等待时间限制在剩余时间内"""
+    d = _DEADLINE.get()
+    if d is None:
+        return value
+    return max(0, min(value, d.remaining()))
@@ -0,0 +1,532 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+本地的KM替身服务，用于在没有真实KM的环境下测试rancher.Client、comm中的等待函数和性能：
+    /v3                     apiRoot，X-API-Schemas头指向/v3/schemas
+    /v3/schemas             录制的schema(--schema)或内置的简单schema
+    /v3/<type>s[/<id>]      CRUD，支持limit/marker分页、字段过滤(name=、name_ne=、id_in=)、ETag
+    ?action=<name>          资源操作，返回资源本身
+    /v3/subscribe           websocket，推送resource.create/change/remove事件
+    /v3-public/localproviders/local?action=login  登录，返回token
+创建、修改、删除后资源处于transitioning状态，经过transition_delay秒后变为active或被删除，
+latency/jitter/error_rate用于注入延迟和503错误。
+进程内使用：
+    km = FakeKM(transition_delay=0.2).start()
+    client = rancher.Client(url=km.url, token=km.token)
+独立进程：
+    python -m common.fake_km --port 8080 --latency 0.01 --error-rate 0.01
+"""
+import argparse
+import base64
+import collections
+import hashlib
+import itertools
+import json
+import random
+import socket
+import struct
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qsl, unquote
+
+DEFAULT_TYPES = ('cluster', 'project', 'namespace', 'user', 'pod', 'secret', 'workload')
+# 分页和排序参数，不作为过滤条件
+LIST_PARAMS = ('limit', 'marker', 'sort', 'order')
+WS_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+TICK_INTERVAL = 0.02
+
+
+class FakeKM(object):
+    def __init__(self, schema=None, host='127.0.0.1', port=0, latency=0, jitter=0,
+                 error_rate=0, transition_delay=0.5, token='fake-token',
+                 types=DEFAULT_TYPES):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.transition_delay = transition_delay
+        self.token = token
+        self.schemas = _load_schemas(schema) if schema else _default_schemas(types)
+        # collection路径 -> type
+        self.collections = {s['collectionPath']: s['id'] for s in self.schemas}
+        self.store = collections.defaultdict(collections.OrderedDict)
+        self.lock = threading.RLock()
+        self.counts = collections.Counter()
+        self._ids = itertools.count(1)
+        self._revision = itertools.count(1)
+        self._subscribers = []
+        self._closed = threading.Event()
+        self.server = _Server((host, port), _Handler)
+        self.server.km = self
+        self._seed()
+
+    @property
+    def origin(self):
+        host, port = self.server.server_address[:2]
+        return 'http://{}:{}'.format(host, port)
+
+    @property
+    def url(self):
+        return self.origin + '/v3'
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        threading.Thread(target=self._tick, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._closed.set()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def _seed(self):
+        if 'user' in self.collections.values():
+            self.add('user', {'id': 'user-admin', 'username': 'admin', 'name': 'admin'})
+        if 'cluster' in self.collections.values():
+            self.add('cluster', {'id': 'local', 'name': 'local'})
+
+    def add(self, type, obj, transitioning=False):
+        """直接添加资源，例如预置测试数据"""
+        obj = dict(obj)
+        obj.setdefault('id', '{}-{:05d}'.format(type, next(self._ids)))
+        obj['type'] = type
+        obj.setdefault('created', time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()))
+        with self.lock:
+            self.store[type][obj['id']] = obj
+            if transitioning:
+                self._transition(obj, 'activating', 'active')
+            else:
+                obj.setdefault('state', 'active')
+                obj['transitioning'] = 'no'
+                obj['transitioningMessage'] = ''
+                obj['_revision'] = next(self._revision)
+        self._publish('resource.create', obj)
+        return obj
+
+    def _transition(self, obj, state, final_state):
+        obj['state'] = state
+        obj['transitioning'] = 'yes'
+        obj['transitioningMessage'] = ''
+        obj['_final'] = final_state
+        obj['_until'] = time.time() + self.transition_delay
+        obj['_revision'] = next(self._revision)
+
+    def _tick(self):
+        # 到期的transitioning资源变为最终状态，删除中的资源被移除
+        while not self._closed.wait(TICK_INTERVAL):
+            now = time.time()
+            events = []
+            with self.lock:
+                for type, objs in self.store.items():
+                    for obj in list(objs.values()):
+                        if obj.get('_until') is None or obj['_until'] > now:
+                            continue
+                        final = obj.pop('_final')
+                        obj.pop('_until')
+                        obj['_revision'] = next(self._revision)
+                        if final is None:
+                            del objs[obj['id']]
+                            events.append(('resource.remove', obj))
+                        else:
+                            obj['state'] = final
+                            obj['transitioning'] = 'no'
+                            events.append(('resource.change', obj))
+            for name, obj in events:
+                self._publish(name, obj)
+
+    def render(self, obj):
+        type = obj['type']
+        schema = self._schema(type)
+        base = self.origin + schema['collectionPath'] + '/' + obj['id']
+        data = {k: v for k, v in obj.items() if not k.startswith('_')}
+        data['links'] = {'self': base, 'update': base, 'remove': base}
+        data['actions'] = {name: base + '?action=' + name
+                           for name in schema.get('resourceActions') or {}}
+        return data
+
+    def render_schema(self, schema):
+        data = {k: v for k, v in schema.items() if k != 'collectionPath'}
+        data['links'] = {'self': self.url + '/schemas/' + schema['id'],
+                         'collection': self.origin + schema['collectionPath']}
+        return data
+
+    def _schema(self, type):
+        for schema in self.schemas:
+            if schema['id'] == type:
+                return schema
+        raise KeyError(type)
+
+    def route(self, path):
+        """路径 -> (type, id)，不是资源路径时返回(None, None)"""
+        path = path.rstrip('/')
+        if path in self.collections:
+            return self.collections[path], None
+        parent, _, id = path.rpartition('/')
+        if parent in self.collections:
+            return self.collections[parent], unquote(id)
+        return None, None
+
+    def _publish(self, name, obj):
+        if not self._subscribers:
+            return
+        message = json.dumps({'name': name, 'data': self.render(obj)}).encode('utf-8')
+        for subscriber in list(self._subscribers):
+            try:
+                subscriber.send(message)
+            except OSError:
+                self._unsubscribe(subscriber)
+
+    def _subscribe(self, subscriber):
+        with self.lock:
+            self._subscribers.append(subscriber)
+
+    def _unsubscribe(self, subscriber):
+        with self.lock:
+            if subscriber in self._subscribers:
+                self._subscribers.remove(subscriber)
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    # 默认的listen backlog为5，并发连接较多时会丢弃SYN导致1秒的重传延迟
+    request_queue_size = 128
+
+
+class _Subscriber(object):
+    def __init__(self, wfile):
+        self._wfile = wfile
+        self._lock = threading.Lock()
+
+    def send(self, payload, opcode=0x1):
+        n = len(payload)
+        if n < 126:
+            header = struct.pack('>BB', 0x80 | opcode, n)
+        elif n < 65536:
+            header = struct.pack('>BBH', 0x80 | opcode, 126, n)
+        else:
+            header = struct.pack('>BBQ', 0x80 | opcode, 127, n)
+        with self._lock:
+            self._wfile.write(header + payload)
+            self._wfile.flush()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # 响应头和响应体分开写入，避免Nagle算法和延迟ACK带来的40ms延迟
+    disable_nagle_algorithm = True
+
+    @property
+    def km(self):
+        return self.server.km
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, body=None, headers=None):
+        data = json.dumps(body).encode('utf-8') if body is not None else b''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _error(self, status, code, message=''):
+        self._send(status, {'type': 'error', 'status': status, 'code': code,
+                            'message': message})
+
+    def _read_body(self):
+        # 在返回任何响应(包括注入的错误、404)之前读取完请求体，
+        # 否则keep-alive连接上剩余的请求体会被当作下一个请求解析
+        n = int(self.headers.get('Content-Length') or 0)
+        self._raw_body = self.rfile.read(n) if n else b''
+
+    def _body(self):
+        if not self._raw_body:
+            return {}
+        try:
+            return json.loads(self._raw_body)
+        except ValueError:
+            return {}
+
+    def _inject(self):
+        # 注入延迟和错误，返回True表示已经返回了错误
+        km = self.km
+        if km.latency or km.jitter:
+            time.sleep(km.latency + random.uniform(0, km.jitter))
+        if km.error_rate and random.random() < km.error_rate:
+            self._error(503, 'ServiceUnavailable', 'injected error')
+            return True
+        return False
+
+    def _handle(self, method):
+        km = self.km
+        parts = urlsplit(self.path)
+        query = parse_qsl(parts.query, keep_blank_values=True)
+        km.counts[method] += 1
+        if parts.path == '/v3/subscribe' and \
+                self.headers.get('Upgrade', '').lower() == 'websocket':
+            return self._websocket()
+        self._read_body()
+        if method == 'POST' and parts.path.startswith('/v3-public/') and \
+                dict(query).get('action') == 'login':
+            return self._send(200, {'type': 'token', 'token': km.token})
+        if self._inject():
+            return
+        if method == 'GET' and parts.path.rstrip('/') == '/v3':
+            return self._send(200, {'type': 'apiRoot', 'links': {'schemas': km.url + '/schemas'}},
+                              {'X-API-Schemas': km.url + '/schemas'})
+        if method == 'GET' and parts.path.rstrip('/') == '/v3/schemas':
+            return self._send(200, {'type': 'collection', 'resourceType': 'schema',
+                                    'data': [km.render_schema(s) for s in km.schemas]},
+                              {'ETag': '"schemas"'})
+        if method == 'GET' and parts.path.startswith('/v3/schemas/'):
+            type = parts.path.rsplit('/', 1)[1]
+            try:
+                return self._send(200, km.render_schema(km._schema(type)))
+            except KeyError:
+                return self._error(404, 'NotFound', type)
+
+        type, id = km.route(parts.path)
+        if type is None:
+            return self._error(404, 'NotFound', parts.path)
+        action = dict(query).get('action')
+        if action and method == 'POST':
+            return self._action(type, id, action)
+        if id is None:
+            if method == 'GET':
+                return self._list(type, query)
+            if method == 'POST':
+                return self._create(type)
+            return self._error(405, 'MethodNotAllowed')
+        if method == 'GET':
+            return self._get(type, id)
+        if method == 'PUT':
+            return self._update(type, id)
+        if method == 'DELETE':
+            return self._delete(type, id)
+        return self._error(405, 'MethodNotAllowed')
+
+    def _list(self, type, query):
+        km = self.km
+        params = collections.defaultdict(list)
+        for k, v in query:
+            params[k].append(v)
+        # users?me=true返回token对应的用户，FakeKM只有admin一个登录用户
+        me = params.pop('me', None) == ['true'] and type == 'user'
+        limit = int(params.pop('limit', ['1000'])[0])
+        marker = params.pop('marker', [None])[0]
+        for k in LIST_PARAMS:
+            params.pop(k, None)
+        with km.lock:
+            items = [o for o in km.store[type].values() if _match(o, params)]
+            if me:
+                items = [o for o in items if o['id'] == 'user-admin']
+        items.sort(key=lambda o: o['id'])
+        if marker:
+            items = [o for o in items if o['id'] > marker]
+        page, rest = items[:limit], items[limit:]
+        pagination = {'limit': limit, 'total': len(items)}
+        if rest:
+            pagination['next'] = '{}{}?{}'.format(
+                km.origin, km._schema(type)['collectionPath'],
+                '&'.join(['limit={}'.format(limit), 'marker=' + page[-1]['id']] +
+                         ['{}={}'.format(k, v) for k, vs in params.items() for v in vs]))
+        self._send(200, {'type': 'collection', 'resourceType': type,
+                         'pagination': pagination,
+                         'data': [km.render(o) for o in page]})
+
+    def _get(self, type, id):
+        km = self.km
+        with km.lock:
+            obj = km.store[type].get(id)
+            data = km.render(obj) if obj is not None else None
+            etag = '"{}"'.format(obj['_revision']) if obj is not None else None
+        if data is None:
+            return self._error(404, 'NotFound', id)
+        if self.headers.get('If-None-Match') == etag:
+            return self._send(304, None, {'ETag': etag})
+        self._send(200, data, {'ETag': etag})
+
+    def _create(self, type):
+        km = self.km
+        body = self._body()
+        body.pop('type', None)
+        obj = km.add(type, body, transitioning=True)
+        with km.lock:
+            data = km.render(obj)
+        self._send(201, data)
+
+    def _update(self, type, id):
+        km = self.km
+        body = self._body()
+        with km.lock:
+            obj = km.store[type].get(id)
+            if obj is None:
+                return self._error(404, 'NotFound', id)
+            for k, v in body.items():
+                if k not in ('id', 'type', 'links', 'actions') and not k.startswith('_'):
+                    obj[k] = v
+            km._transition(obj, 'updating', 'active')
+            data = km.render(obj)
+        km._publish('resource.change', obj)
+        self._send(200, data)
+
+    def _delete(self, type, id):
+        km = self.km
+        with km.lock:
+            obj = km.store[type].get(id)
+            if obj is None:
+                return self._error(404, 'NotFound', id)
+            km._transition(obj, 'removing', None)
+            data = km.render(obj)
+        km._publish('resource.change', obj)
+        self._send(200, data)
+
+    def _action(self, type, id, action):
+        km = self.km
+        with km.lock:
+            obj = km.store[type].get(id) if id else None
+            if id and obj is None:
+                return self._error(404, 'NotFound', id)
+            data = km.render(obj) if obj is not None else {'type': action}
+        self._send(200, data)
+
+    def _websocket(self):
+        key = self.headers.get('Sec-WebSocket-Key', '')
+        accept = base64.b64encode(hashlib.sha1((key + WS_GUID).encode('utf-8')).digest())
+        self.send_response(101, 'Switching Protocols')
+        self.send_header('Upgrade', 'websocket')
+        self.send_header('Connection', 'Upgrade')
+        self.send_header('Sec-WebSocket-Accept', accept.decode('utf-8'))
+        self.end_headers()
+        self.wfile.flush()
+        subscriber = _Subscriber(self.wfile)
+        self.km._subscribe(subscriber)
+        try:
+            while True:
+                opcode, payload = _read_frame(self.rfile)
+                if opcode is None or opcode == 0x8:
+                    break
+                if opcode == 0x9:
+                    subscriber.send(payload, opcode=0xA)
+        except (OSError, socket.timeout):
+            pass
+        finally:
+            self.km._unsubscribe(subscriber)
+            self.close_connection = True
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def do_PUT(self):
+        self._handle('PUT')
+
+    def do_DELETE(self):
+        self._handle('DELETE')
+
+
+def _read_frame(rfile):
+    header = rfile.read(2)
+    if len(header) < 2:
+        return None, None
+    opcode = header[0] & 0x0f
+    masked = header[1] & 0x80
+    n = header[1] & 0x7f
+    if n == 126:
+        n = struct.unpack('>H', rfile.read(2))[0]
+    elif n == 127:
+        n = struct.unpack('>Q', rfile.read(8))[0]
+    mask = rfile.read(4) if masked else None
+    payload = rfile.read(n)
+    if mask:
+        payload = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+    return opcode, payload
+
+
+def _match(obj, params):
+    for k, values in params.items():
+        if k.endswith('_ne'):
+            if str(obj.get(k[:-3])) in values:
+                return False
+        elif k.endswith('_in'):
+            allowed = set(v for value in values for v in value.split(','))
+            if str(obj.get(k[:-3])) not in allowed:
+                return False
+        elif str(obj.get(k)) not in values:
+            return False
+    return True
+
+
+def _default_schemas(types):
+    schemas = []
+    for type in types:
+        schemas.append({
+            'id': type,
+            'type': 'schema',
+            'collectionPath': '/v3/' + type + 's',
+            'collectionMethods': ['GET', 'POST'],
+            'resourceMethods': ['GET', 'PUT', 'DELETE'],
+            'resourceActions': {},
+            'collectionFilters': {
+                'name': {'modifiers': ['eq', 'ne', 'in']},
+                'id': {'modifiers': ['eq', 'ne', 'in']}
+            },
+            'resourceFields': {'name': {'type': 'string'}}
+        })
+    return schemas
+
+
+def _load_schemas(path):
+    """录制的schema：/v3/schemas的响应，或SchemaCache保存的json"""
+    with open(path, encoding='utf-8') as f:
+        data = json.load(f)
+    if isinstance(data, dict):
+        data = data.get('data', [])
+    schemas = []
+    for schema in data:
+        if schema.get('type') != 'schema':
+            continue
+        collection = (schema.get('links') or {}).get('collection')
+        if not collection:
+            continue
+        schema = dict(schema)
+        schema.pop('links', None)
+        schema['collectionPath'] = urlsplit(collection).path.rstrip('/')
+        schemas.append(schema)
+    return schemas
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Rancher/KM API stand-in server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--schema', help='recorded /v3/schemas response')
+    parser.add_argument('--latency', type=float, default=0)
+    parser.add_argument('--jitter', type=float, default=0)
+    parser.add_argument('--error-rate', type=float, default=0)
+    parser.add_argument('--transition-delay', type=float, default=0.5)
+    args = parser.parse_args()
+    km = FakeKM(schema=args.schema, host=args.host, port=args.port,
+                latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                transition_delay=args.transition_delay).start()
+    print('fake KM listening on {}'.format(km.url), flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        km.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import contextlib
+import contextvars
+import json
+import os
+import time
+
+from filelock import FileLock
+
+from common import deadline
+
+# 每类接口的限速(请求/秒)和最大并发请求数，所有进程共享，例如：lists=20,writes=10,actions=5
+RATE_LIMIT = os.environ.get('RANCHER_RATE_LIMIT')
+MAX_IN_FLIGHT = os.environ.get('RANCHER_MAX_IN_FLIGHT')
+# 接口分类：lists列表查询，reads按id查询，writes创建/修改/删除，actions资源操作
+ENDPOINT_CLASSES = ('lists', 'reads', 'writes', 'actions')
+# 低优先级请求(例如teardown中的删除)为普通请求保留的令牌和并发比例
+LOW_PRIORITY_RESERVE = 0.5
+# 达到并发上限时的轮询间隔
+POLL_INTERVAL = 0.05
+
+_LOW_PRIORITY = contextvars.ContextVar('rancher_low_priority', default=False)
+
+
+class Governor(object):
+    """
+    多个pytest-xdist worker共享的令牌桶限速和最大并发控制，状态保存在path的json文件中，
+    通过文件锁在进程间同步。每个进程的并发数按pid记录，进程退出后自动清理
+    """
+
+    def __init__(self, path, rates=None, max_in_flight=None,
+                 low_priority_reserve=LOW_PRIORITY_RESERVE):
+        self.path = str(path)
+        dirname = os.path.dirname(self.path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        self._lock = FileLock(self.path + '.lock')
+        self.rates = rates or {}
+        self.max_in_flight = max_in_flight or {}
+        self.low_priority_reserve = low_priority_reserve
+
+    def acquire(self, endpoint_class, low_priority=False, timeout=None):
+        """
+        获取一个请求配额，返回是否需要release；超过timeout仍未获取到时抛出DeadlineExceeded
+        """
+        rate = self.rates.get(endpoint_class)
+        limit = self.max_in_flight.get(endpoint_class)
+        if rate is None and limit is None:
+            return False
+
+        expires = None if timeout is None else time.time() + timeout
+        while True:
+            with self._lock:
+                state = self._read()
+                wait = self._take(state, endpoint_class, rate, limit, low_priority)
+                self._write(state)
+            if wait == 0:
+                return limit is not None
+            if expires is not None:
+                remaining = expires - time.time()
+                if remaining <= 0:
+                    raise deadline.DeadlineExceeded(
+                        'Timeout waiting for {} request quota'.format(endpoint_class))
+                wait = min(wait, remaining)
+            time.sleep(wait)
+
+    def release(self, endpoint_class):
+        with self._lock:
+            state = self._read()
+            in_flight = state['in_flight'].get(endpoint_class, {})
+            pid = str(os.getpid())
+            if in_flight.get(pid, 0) > 1:
+                in_flight[pid] -= 1
+            else:
+                in_flight.pop(pid, None)
+            self._write(state)
+
+    @contextlib.contextmanager
+    def slot(self, endpoint_class):
+        acquired = self.acquire(endpoint_class, is_low_priority(),
+                                deadline.remaining())
+        try:
+            yield
+        finally:
+            if acquired:
+                self.release(endpoint_class)
+
+    def _take(self, state, endpoint_class, rate, limit, low_priority):
+        # 返回0表示获取成功，否则返回建议的等待时间
+        reserve = self.low_priority_reserve if low_priority else 0
+        if limit is not None:
+            in_flight = state['in_flight'].setdefault(endpoint_class, {})
+            allowed = max(1, int(limit * (1 - reserve)))
+            if sum(in_flight.values()) >= allowed:
+                _prune(in_flight)
+                if sum(in_flight.values()) >= allowed:
+                    return POLL_INTERVAL
+
+        if rate is not None:
+            now = time.time()
+            burst = max(1.0, rate)
+            bucket = state['buckets'].setdefault(
+                endpoint_class, {'tokens': burst, 'updated': now})
+            tokens = min(burst, bucket['tokens'] + (now - bucket['updated']) * rate)
+            bucket['tokens'] = tokens
+            bucket['updated'] = now
+            need = 1 + reserve * burst
+            if tokens < need:
+                return (need - tokens) / rate
+            bucket['tokens'] = tokens - 1
+
+        if limit is not None:
+            pid = str(os.getpid())
+            in_flight[pid] = in_flight.get(pid, 0) + 1
+        return 0
+
+    def _read(self):
+        try:
+            with open(self.path) as f:
+                state = json.load(f)
+        except (IOError, ValueError):
+            state = {}
+        state.setdefault('buckets', {})
+        state.setdefault('in_flight', {})
+        return state
+
+    def _write(self, state):
+        with open(self.path, 'w') as f:
+            json.dump(state, f)
+
+
+def _prune(in_flight):
+    # 清理已退出进程的并发计数
+    for pid in list(in_flight):
+        try:
+            os.kill(int(pid), 0)
+        except ProcessLookupError:
+            del in_flight[pid]
+        except PermissionError:
+            pass
+
+
+def endpoint_class(method, url, collections=()):
+    if 'action=' in url:
+        return 'actions'
+    if method != 'GET':
+        return 'writes'
+    if url.split('?', 1)[0].rstrip('/') in collections:
+        return 'lists'
+    return 'reads'
+
+
+@contextlib.contextmanager
+def low_priority():
+    """在其中发起的请求为低优先级，例如teardown中的删除：
+        with governor.low_priority():
+            client.delete_many(resources)
+    """
+    token = _LOW_PRIORITY.set(True)
+    try:
+        yield
+    finally:
+        _LOW_PRIORITY.reset(token)
+
+
+def is_low_priority():
+    return _LOW_PRIORITY.get()
+
+
+def _parse_limits(text):
+    # "lists=20,writes=10" -> {'lists': 20.0, 'writes': 10.0}
+    limits = {}
+    for item in (text or '').split(','):
+        if '=' in item:
+            k, v = item.split('=', 1)
+            limits[k.strip()] = float(v)
+    return limits
+
+
+GOVERNOR = None
+
+
+def configure(path, rates=None, max_in_flight=None, **kw):
+    """
+    开启进程间共享的限速，rates/max_in_flight未指定时读取RANCHER_RATE_LIMIT/RANCHER_MAX_IN_FLIGHT，
+    都没有配置时不限速，返回None
+    """
+    global GOVERNOR
+    rates = _parse_limits(RATE_LIMIT) if rates is None else rates
+    if max_in_flight is None:
+        max_in_flight = {k: int(v) for k, v in _parse_limits(MAX_IN_FLIGHT).items()}
+    if not rates and not max_in_flight:
+        GOVERNOR = None
+    else:
+        GOVERNOR = Governor(path, rates, max_in_flight, **kw)
+    return GOVERNOR
+
+
+def get_governor():
+    return GOVERNOR
@@ -0,0 +1,291 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+rancher.Client的接口耗时统计：按 方法 + url模板(资源id替换为{id}) 汇总每个请求各阶段的耗时直方图：
+    connect   新建连接(包括TLS握手)的耗时，复用连接时不记录，AsyncClient不单独统计
+    ttfb      请求发出到收到响应头
+    download  读取响应体
+    total     单次http请求的总耗时，重试的每次请求分别记录
+    parse     json解析
+    build     转换为RestObject/Resource
+会话级的统计始终开启，collect()中的请求同时记入单独的Registry，例如每个测试用例的统计，见conftest
+"""
+import contextlib
+import contextvars
+import json
+import math
+import os
+import re
+import threading
+import time
+from urllib.parse import urlsplit, parse_qsl
+
+try:
+    import allure
+except ImportError:
+    allure = None
+
+# RANCHER_METRICS=0 时关闭统计
+ENABLED = os.environ.get('RANCHER_METRICS') != '0'
+# 直方图相邻分桶的比例，百分位的相对误差不超过5%
+GROWTH = 1.05
+MIN_VALUE = 1e-6
+PERCENTILES = (50, 95, 99)
+PHASES = ('connect', 'ttfb', 'download', 'total', 'parse', 'build')
+# url模板缓存的条数
+MAX_TEMPLATES = 4096
+
+_LOG_GROWTH = math.log(GROWTH)
+# 包含数字和-、包含:的路径段视为资源id，例如c-abc12、c-abc:p-xyz、default:pod-1、uuid
+_ID = re.compile(r'^(?:\d+|[^/]*:[^/]*|[^/]*-[^/]*\d[^/]*|[^/]*\d[^/]*-[^/]*|[0-9a-f]{16,})$')
+# api版本，例如v3、v3-public、v1beta1
+_VERSION = re.compile(r'^v\d+(?:(?:alpha|beta)\d+)?(?:-public)?$')
+_CONNECT = threading.local()
+_CURRENT = contextvars.ContextVar('rancher_metrics_endpoint', default=None)
+
+
+class Histogram(object):
+    """对数分桶的直方图，内存占用与样本数无关"""
+
+    def __init__(self):
+        self.buckets = {}
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def add(self, value):
+        i = 0 if value <= MIN_VALUE else int(math.log(value / MIN_VALUE) / _LOG_GROWTH) + 1
+        self.buckets[i] = self.buckets.get(i, 0) + 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, p):
+        if not self.count:
+            return 0.0
+        rank = max(1, int(math.ceil(self.count * p / 100.0)))
+        seen = 0
+        for i in sorted(self.buckets):
+            seen += self.buckets[i]
+            if seen >= rank:
+                return min(self.max, MIN_VALUE * GROWTH ** i)
+        return self.max
+
+    def summary(self):
+        # 耗时单位为毫秒
+        ret = {'count': self.count, 'sum': _ms(self.sum), 'max': _ms(self.max)}
+        for p in PERCENTILES:
+            ret['p{}'.format(p)] = _ms(self.percentile(p))
+        return ret
+
+
+class EndpointStats(object):
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.bytes = 0
+        self.phases = {}
+
+    def add(self, phases, size=0, error=False, request=True):
+        if request:
+            self.count += 1
+            self.bytes += size
+            if error:
+                self.errors += 1
+        for name, value in phases.items():
+            histogram = self.phases.get(name)
+            if histogram is None:
+                histogram = self.phases[name] = Histogram()
+            histogram.add(value)
+
+    def time(self):
+        # 该接口占用的总时间：http请求 + 解析 + 构建对象
+        return sum(self.phases[name].sum for name in ('total', 'parse', 'build')
+                   if name in self.phases)
+
+
+class Registry(object):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.endpoints = {}
+        self.started = time.time()
+
+    def observe(self, key, phases, size=0, error=False, request=True):
+        with self._lock:
+            stats = self.endpoints.get(key)
+            if stats is None:
+                stats = self.endpoints[key] = EndpointStats()
+            stats.add(phases, size, error, request)
+
+    def summary(self):
+        """按占用时间从大到小排列的各接口统计，耗时单位为毫秒"""
+        with self._lock:
+            items = list(self.endpoints.items())
+        endpoints = []
+        for (method, template), stats in items:
+            endpoints.append({
+                'endpoint': '{} {}'.format(method, template),
+                'count': stats.count,
+                'errors': stats.errors,
+                'bytes': stats.bytes,
+                'time': _ms(stats.time()),
+                'phases': {name: stats.phases[name].summary()
+                           for name in PHASES if name in stats.phases}
+            })
+        endpoints.sort(key=lambda e: e['time'], reverse=True)
+        return {
+            'requests': sum(e['count'] for e in endpoints),
+            'errors': sum(e['errors'] for e in endpoints),
+            'bytes': sum(e['bytes'] for e in endpoints),
+            'time': _ms(sum(e['time'] for e in endpoints) / 1000.0),
+            'duration': _ms(time.time() - self.started),
+            'endpoints': endpoints
+        }
+
+    def empty(self):
+        return not self.endpoints
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 3)
+
+
+SESSION = Registry()
+_ACTIVE = (SESSION,)
+_ACTIVE_LOCK = threading.Lock()
+_TEMPLATES = {}
+
+
+@contextlib.contextmanager
+def collect():
+    """
+    在其中发起的请求(包括其他线程)同时记入新的Registry：
+        with metrics.collect() as registry:
+            ...
+        registry.summary()
+    """
+    global _ACTIVE
+    registry = Registry()
+    with _ACTIVE_LOCK:
+        _ACTIVE = _ACTIVE + (registry,)
+    try:
+        yield registry
+    finally:
+        with _ACTIVE_LOCK:
+            _ACTIVE = tuple(r for r in _ACTIVE if r is not registry)
+
+
+def template(url, collections=()):
+    """
+    url -> 模板：去掉host，schema中collection之后的路径段和形如资源id的路径段替换为{id}，
+    查询参数只保留action
+    """
+    key = (url, bool(collections))
+    ret = _TEMPLATES.get(key)
+    if ret is not None:
+        return ret
+    parts = urlsplit(url)
+    origin = '{}://{}'.format(parts.scheme, parts.netloc)
+    segments = parts.path.split('/')
+    path = []
+    after_collection = False
+    for segment in segments:
+        if segment and (after_collection or
+                        (_ID.match(segment) and not _VERSION.match(segment))):
+            path.append('{id}')
+            after_collection = False
+        else:
+            path.append(segment)
+            after_collection = bool(collections) and \
+                origin + '/'.join(segments[:len(path)]) in collections
+    ret = '/'.join(path)
+    action = dict(parse_qsl(parts.query)).get('action')
+    if action:
+        ret += '?action=' + action
+    if len(_TEMPLATES) >= MAX_TEMPLATES:
+        _TEMPLATES.clear()
+    _TEMPLATES[key] = ret
+    return ret
+
+
+def endpoint(method, url, collections=()):
+    return method, template(url, collections)
+
+
+def start():
+    """开始一次http请求，返回开始时间"""
+    _CONNECT.value = 0.0
+    return time.perf_counter()
+
+
+def add_connect(seconds):
+    # 由transport中的连接类调用，与请求在同一个线程
+    _CONNECT.value = getattr(_CONNECT, 'value', 0.0) + seconds
+
+
+def response(key, started, first_byte, size, status):
+    """
+    记录一次完成的http请求：first_byte为收到响应头的时间(perf_counter)，
+    之后同一上下文中的_unmarshall记入该接口的parse/build
+    """
+    if not ENABLED:
+        return
+    end = time.perf_counter()
+    connect = getattr(_CONNECT, 'value', 0.0)
+    phases = {'ttfb': max(0.0, first_byte - started - connect),
+              'download': max(0.0, end - first_byte),
+              'total': end - started}
+    if connect:
+        phases['connect'] = connect
+    for registry in _ACTIVE:
+        registry.observe(key, phases, size, status >= 400)
+    _CURRENT.set(key)
+
+
+def failed(key, started):
+    """记录一次没有收到响应的http请求(连接错误、超时)"""
+    if not ENABLED:
+        return
+    phases = {'total': time.perf_counter() - started}
+    for registry in _ACTIVE:
+        registry.observe(key, phases, 0, True)
+
+
+def parsed(parse, build):
+    """记录最近一次请求的响应的json解析和对象构建耗时"""
+    key = _CURRENT.get()
+    if not ENABLED or key is None:
+        return
+    _CURRENT.set(None)
+    phases = {'parse': parse, 'build': build}
+    for registry in _ACTIVE:
+        registry.observe(key, phases, request=False)
+
+
+def write_json(path, summary):
+    dirname = os.path.dirname(path)
+    if dirname:
+        os.makedirs(dirname, exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(summary, f, indent=2, ensure_ascii=False)
+
+
+def attach(name, summary):
+    """作为json附件添加到allure报告，未安装allure时不做任何事"""
+    if allure is None:
+        return
+    allure.attach(json.dumps(summary, indent=2, ensure_ascii=False), name=name,
+                  attachment_type=allure.attachment_type.JSON)
+
+
+def format_summary(summary, top=10):
+    """占用时间最多的top个接口，用于终端输出"""
+    lines = ['{:<8} {:>8} {:>10} {:>10} {:>10} {:>10}  {}'.format(
+        'requests', 'errors', 'time(ms)', 'p50(ms)', 'p95(ms)', 'p99(ms)', 'endpoint')]
+    for e in summary['endpoints'][:top]:
+        total = e['phases'].get('total', {})
+        lines.append('{:<8} {:>8} {:>10.1f} {:>10.1f} {:>10.1f} {:>10.1f}  {}'.format(
+            e['count'], e['errors'], e['time'], total.get('p50', 0), total.get('p95', 0),
+            total.get('p99', 0), e['endpoint']))
+    return '\n'.join(lines)
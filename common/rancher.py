@@ -1,13 +1,37 @@
 # !/usr/bin/env python
-import copy
+import asyncio
 import re
+import httpx
 import requests
 import collections
+import contextlib
+import contextvars
 import hashlib
+import importlib
 import os
 import json
 import time
 import logging
+import functools
+import threading
+import pickle
+import queue
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+from filelock import FileLock
+from common import api_log
+from common.codec import get_codec
+from common.retry import get_retry_policy, CONFLICT_STATUS
+from common import deadline
+from common import transport
+from common import governor
+from common import cassette
+from common import upload
+from common import changes
+from common import serializer
+from common import metrics
+from common.subscription import SubscriptionManager, RESOURCE_REMOVE
 
 logger = logging.getLogger(__name__)
 
@@ -21,8 +45,21 @@ def _prefix(cmd):
 
 PREFIX = _prefix(__file__)
 CACHE_DIR = '~/.' + PREFIX.lower()
-TIME = not os.environ.get('TIME_API') is None
+SUBSCRIBE = not os.environ.get('RANCHER_SUBSCRIBE') is None
+SINGLE_FLIGHT = not os.environ.get('RANCHER_SINGLE_FLIGHT') is None
+# 记录解析出的资源的原始数据，update时只发送修改过的字段
+TRACK_CHANGES = not os.environ.get('RANCHER_TRACK_CHANGES') is None
+# common/codegen.py生成的schema模块，KM版本一致时代替请求schema
+SCHEMA_MODULE = os.environ.get('RANCHER_SCHEMA_MODULE')
+SERVER_VERSION_PATH = '/v3/settings/server-version'
+# token对应的当前用户，用于磁盘schema缓存按用户区分
+CURRENT_USER_PATH = '/v3/users?me=true'
 DEFAULT_TIMEOUT = 45
+# 单个请求的连接超时和读超时，在deadline上下文中不超过剩余时间
+CONNECT_TIMEOUT = float(os.environ.get('RANCHER_CONNECT_TIMEOUT') or 10)
+READ_TIMEOUT = float(os.environ.get('RANCHER_READ_TIMEOUT') or 60)
+# 开启订阅时，等待资源变化事件的最长时间，超时后重新获取资源兜底
+SUBSCRIBE_FALLBACK_INTERVAL = 5
 
 LIST = 'list-'
 CREATE = 'create-'
@@ -41,49 +78,124 @@ HEADERS = {'Accept': 'application/json'}
 
 LIST_METHODS = {'__iter__': True, '__len__': True, '__getitem__': True}
 
+# 每个Client最多缓存的资源字段布局数量
+MAX_LAYOUTS = 1024
+
+# 批量操作默认的并发数
+DEFAULT_BULK_CONCURRENCY = 8
+
+# GET条件请求缓存默认的条数
+DEFAULT_RESPONSE_CACHE_SIZE = 1024
+# 连接错误(连接被重置、超时、响应体读取中断)，按RetryPolicy重试幂等方法
+RETRY_EXCEPTIONS = (requests.exceptions.ConnectionError,
+                    requests.exceptions.Timeout,
+                    requests.exceptions.ChunkedEncodingError)
+
+# deadline到期时请求抛出的异常：请求前已经超时，或者超时被限制为剩余时间的请求读超时/连接超时
+DEADLINE_ERRORS = (deadline.DeadlineExceeded,
+                   requests.exceptions.Timeout,
+                   httpx.TimeoutException)
+
+# 根据schema绑定到Client上的方法：(方法名前缀, schema中的方法集合, 需要支持的http方法)
+BINDINGS = [
+    ('list', 'collectionMethods', GET_METHOD),
+    ('by_id', 'collectionMethods', GET_METHOD),
+    ('update_by_id', 'resourceMethods', PUT_METHOD),
+    ('create', 'collectionMethods', POST_METHOD)
+]
+
+
+def _replayable(kw):
+    # 文件流、生成器等请求体只能发送一次，不按RetryPolicy重试
+    body = kw.get('data', kw.get('content'))
+    return body is None or isinstance(body, (bytes, str, dict))
+
 
 def request(fn):
+    method = fn.__name__.upper().replace("__", "")
+
+    if asyncio.iscoroutinefunction(fn):
+        async def async_wrapped(*args, **kw):
+            ctx = _log_request(method, args, kw)
+            try:
+                r = await fn(*args, **kw)
+            except ApiError as e:
+                _log_error(e, ctx)
+                raise
+            _log_response(r, ctx)
+            return r
+
+        return async_wrapped
+
     def wrapped(*args, **kw):
-        func_name = fn.__name__
-        logger.info('------------------ Request ---------------------')
-        try:
-            url = list(args)[1]
-        except IndexError:
-            url = kw.get("url", "")
-        logger.info("[method]: {m}    [url]: {u} ".format(m=func_name.upper().replace("__", ""), u=url))
-        data = kw.get("data", "")
-        if data != "" and data != {} and data is not None:
-            logger.debug(f"[data]:\n {formatting(data)}")
+        ctx = _log_request(method, args, kw)
 
         # running function
-        r = fn(*args, **kw)
-
-        logger.info("------------------ Response --------------------")
-        if r.status_code < 200 or r.status_code > 300:
-            logger.error("unsuccessful with status code {}".format(str(r.status_code)))
-        else:
-            logger.info("successful with status code {}".format(str(r.status_code)))
-        resp_time = r.elapsed.total_seconds()
         try:
-            resp = r.json()
-            logger.debug(f"[type]: json      [time]: {resp_time}")
-            logger.debug(f"[response]:\n {formatting(resp)}")
-        except BaseException as msg:
-            logger.debug(f"[warning]: failed to convert res to json, try to convert to text")
-            logger.debug(f"[warning]: {msg}")
-
-            logger.debug(f"[type]: text      [time]: {resp_time}")
-            logger.debug(f"[response]:\n {r.text}")
+            r = fn(*args, **kw)
+        except ApiError as e:
+            _log_error(e, ctx)
+            raise
 
+        _log_response(r, ctx)
         return r
 
     return wrapped
 
 
+def _log_request(method, args, kw):
+    # 日志级别未开启时不做任何格式化
+    try:
+        url = args[1]
+    except IndexError:
+        url = kw.get("url", "")
+    data = kw.get("data")
+    policy = api_log.get_policy()
+    sampled = policy.sampled()
+    info = policy.enabled(logger, url, logging.INFO)
+    debug = info and sampled and policy.enabled(logger, url, logging.DEBUG)
+    record = sampled and policy.body_writer is not None
+    if info:
+        logger.info('------------------ Request ---------------------')
+        logger.info("[method]: %s    [url]: %s ", method, url)
+        if debug and data != "" and data != {} and data is not None:
+            logger.debug("[data]:\n %s", policy.truncate(formatting(data)))
+    return method, url, data, info, debug, record
+
+
+def _log_error(e, ctx):
+    status = getattr(e.error, 'status', None)
+    if ctx[3]:
+        logger.info("------------------ Response --------------------")
+    # 404是by_id/get、等待资源删除时预期的结果，不记为错误
+    if status == 404:
+        if ctx[3]:
+            logger.info("not found with status code %s", status)
+        return
+    logger.error("unsuccessful with status code %s", status)
+
+
+def _log_response(r, ctx):
+    method, url, data, info, debug, record = ctx
+    if info:
+        logger.info("------------------ Response --------------------")
+    if r.status_code < 200 or (r.status_code > 300 and r.status_code != 304):
+        logger.error("unsuccessful with status code %s", r.status_code)
+    elif info:
+        logger.info("successful with status code %s", r.status_code)
+    if debug:
+        # 直接截断响应文本，不再额外解析一次json
+        text = r.text
+        logger.debug("[time]: %s", r.elapsed.total_seconds())
+        logger.debug("[response]:\n %s", api_log.get_policy().truncate(text))
+    if record:
+        api_log.get_policy().write_body(method, str(url), serializer.to_value(data), r)
+
+
 def formatting(msg):
     """formatted message"""
     if isinstance(msg, dict):
-        return json.dumps(msg, indent=2, ensure_ascii=False)
+        return json.dumps(serializer.to_value(msg), indent=2, ensure_ascii=False)
     return msg
 
 
@@ -96,20 +208,6 @@ def echo(fn):
     return wrapped
 
 
-def timed_url(fn):
-    def wrapped(*args, **kw):
-        if TIME:
-            start = time.time()
-            ret = fn(*args, **kw)
-            delta = time.time() - start
-            print(delta, args[1], fn.__name__)
-            return ret
-        else:
-            return fn(*args, **kw)
-
-    return wrapped
-
-
 class RestObject(object):
     def __init__(self):
         pass
@@ -120,11 +218,8 @@ class RestObject(object):
 
     # __repr__ 功能和 __str__功能一样
     def __repr__(self):
-        data = {}
-        for k, v in self.__dict__.items():
-            if self._is_public(k, v):
-                data[k] = v
-        return repr(data)
+        d = self.__dict__
+        return repr({k: d[k] for k in self._public_keys()})
 
     # 通过a.key获取实例对象的属性值，如果属性值是列表类型，则返回列表的方法
     def __getattr__(self, k):
@@ -141,22 +236,18 @@ class RestObject(object):
         if self._is_list():
             return iter(self.data)
         else:
-            data = {}
-            for k, v in self.__dict__.items():
-                if self._is_public(k, v):
-                    data[k] = v
-            return iter(data.keys())
+            return iter(self._public_keys())
 
     # 获取实例对象的属性数量，如果实例对象是列表类型，则返回列表长度
     def __len__(self):
         if self._is_list():
             return len(self.data)
         else:
-            data = {}
-            for k, v in self.__dict__.items():
-                if self._is_public(k, v):
-                    data[k] = v
-            return len(data)
+            return len(self._public_keys())
+
+    # 公共属性名列表
+    def _public_keys(self):
+        return [k for k, v in self.__dict__.items() if self._is_public(k, v)]
 
     # 判断属性是否为公共属性，即不是方法
     @staticmethod
@@ -181,6 +272,91 @@ class RestObject(object):
         return data
 
 
+serializer.register(RestObject)
+
+
+class Resource(RestObject):
+    """
+    带有type字段的资源对象，links和actions不在解析时绑定，而是在访问时通过__getattr__生成对应的方法：
+    obj.remove() 调用 remove 这个 action，obj.projects() 请求 projects 这个 link，
+    与已有属性重名的 link/action 分别通过 <name>_link 和 <name>_action 访问，
+    分页的集合对象可以通过 next()/prev() 获取上一页和下一页。
+    每个Client会派生出自己的子类，通过类属性_client发起请求，实例上不保存对Client的引用。
+
+    同一type、相同字段顺序的资源共用一个子类(见Client._layout_class)，该子类的_fields记录字段布局：
+    实例的属性字典共享同一份key表，__iter__/__len__/__repr__直接使用_fields，不再每次过滤重建字典。
+    """
+    _client = None
+    _fields = None
+    _field_set = frozenset()
+    _public_fields = None
+
+    def __getattr__(self, k):
+        d = self.__dict__
+        if k in ('next', 'prev') and 'pagination' in d:
+            url = getattr(d['pagination'], k, None)
+            if url is not None:
+                return lambda url=url: self._client._get(url)
+
+        links = self._names('links')
+        actions = self._names('actions')
+
+        link = self._resolve(k, '_link', links)
+        if link is not None:
+            def cb_link(_link=links[link], **kw):
+                return self._client._get(_link, data=kw)
+
+            return cb_link
+
+        action = self._resolve(k, '_action', actions, links)
+        if action is not None:
+            def cb_action(_link_name=action, _result=self, *args, **kw):
+                return self._client.action(_result, _link_name, *args, **kw)
+
+            return cb_action
+
+        return super(Resource, self).__getattr__(k)
+
+    def _public_keys(self):
+        # 字段未被增删时直接返回布局中记录的字段
+        if self._fields is not None and self.__dict__.keys() == self._field_set:
+            return self._fields
+        return super(Resource, self)._public_keys()
+
+    def __dir__(self):
+        names = set(super(Resource, self).__dir__())
+        links = self._names('links')
+        actions = self._names('actions')
+        for link in links:
+            names.add(link + '_link' if self._is_taken(link) else link)
+        for action in actions:
+            if self._is_taken(action) or action in links:
+                names.add(action + '_action')
+            else:
+                names.add(action)
+        return sorted(names)
+
+    def _names(self, key):
+        # 返回links或actions中的 名称->url
+        value = self.__dict__.get(key)
+        if isinstance(value, RestObject) and isinstance(self.__dict__.get('type'), str):
+            return value.__dict__
+        return {}
+
+    def _is_taken(self, name):
+        # 与数据字段、对象方法或dict方法重名
+        return name in self.__dict__ or hasattr(type(self), name) or hasattr(dict, name)
+
+    def _resolve(self, k, suffix, names, taken=()):
+        if k in names and not self._is_taken(k) and k not in taken:
+            return k
+        if k.endswith(suffix):
+            name = k[:-len(suffix)]
+            if name in names and (self._is_taken(name) or name in taken):
+                return name
+        return None
+
+
 class Schema(object):
     def __init__(self, text, obj):
         self.text = text
@@ -223,6 +399,33 @@ class Schema(object):
             if not hasattr(t, 'collectionFilters'):
                 t.collectionFilters = {}
 
+        self._method_table = None
+
+    # 计算一次方法表，key为绑定到Client上的方法名，value为(方法名前缀, type名)，供所有共享该schema的Client复用
+    def method_table(self):
+        if self._method_table is None:
+            table = {}
+            for type_name, typ in self.types.items():
+                for name_variant in Client._type_name_variants(type_name):
+                    for method_name, type_collection, test_method in BINDINGS:
+                        if test_method in getattr(typ, type_collection, []):
+                            table['_'.join([method_name, name_variant])] = \
+                                (method_name, type_name)
+            self._method_table = table
+        return self._method_table
+
+    # 所有type的collection链接，用于区分列表查询和按id查询
+    def collection_urls(self):
+        urls = getattr(self, '_collection_urls', None)
+        if urls is None:
+            urls = set()
+            for typ in self.types.values():
+                url = getattr(getattr(typ, 'links', None), 'collection', None)
+                if url:
+                    urls.add(url.rstrip('/'))
+            urls = self._collection_urls = frozenset(urls)
+        return urls
+
     def __str__(self):
         return str(self.text)
 
@@ -230,6 +433,257 @@ class Schema(object):
         return repr(self.text)
 
 
+class SchemaRegistry(object):
+    """
+    进程内共享的schema缓存，key为(用户身份, schema的url)。
+    KM按用户的权限过滤/v3/schemas，只有url和身份(token/access key)都相同的Client才复用已解析的Schema对象和方法表。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (identity, client url) -> schema url
+        self._schema_urls = {}
+        # (identity, schema url) -> Schema
+        self._schemas = {}
+
+    def lookup(self, url, identity=None):
+        with self._lock:
+            schema_url = self._schema_urls.get((identity, url))
+            return self._schemas.get((identity, schema_url))
+
+    def get(self, schema_url, identity=None):
+        with self._lock:
+            return self._schemas.get((identity, schema_url))
+
+    def register(self, url, schema_url, schema, identity=None):
+        with self._lock:
+            self._schemas[(identity, schema_url)] = schema
+            self._schema_urls[(identity, url)] = schema_url
+
+    def clear(self):
+        with self._lock:
+            self._schema_urls.clear()
+            self._schemas.clear()
+
+
+SCHEMA_REGISTRY = SchemaRegistry()
+
+# (模块名, schema hash, origin) -> 加上origin的schema数据，以及 origin -> KM版本，每个进程只构造/请求一次。
+# Schema中的对象绑定到创建它的Client，因此只缓存数据，每个Client单独构造Schema
+_MODULE_SCHEMAS = {}
+_SERVER_VERSIONS = {}
+_MODULE_SCHEMAS_LOCK = threading.Lock()
+
+
+def _origin(url):
+    parts = urlsplit(url)
+    return '{}://{}'.format(parts.scheme, parts.netloc)
+
+
+def _module_schema(client, module, origin):
+    # 生成的模块中links只保存路径，加上Client的origin
+    key = (module.__name__, module.SCHEMA_HASH, origin)
+    with _MODULE_SCHEMAS_LOCK:
+        data = _MODULE_SCHEMAS.get(key)
+        if data is None:
+            data = [dict(s, links={k: origin + v for k, v in s['links'].items()})
+                    for s in module.SCHEMAS]
+            _MODULE_SCHEMAS[key] = data
+    return Schema(None, client.object_hook(data))
+
+
+class SchemaCache(object):
+    """
+    磁盘上的schema缓存，同一台机器上的多个进程(xdist worker)共享：
+    schema-<hash>.json    原始的schema文本
+    schema-<hash>.pickle  预解析的schema数据，加载时不需要再解析json
+    schema-<hash>.meta    schema url、ETag、Last-Modified和获取时间
+    所有读写都在文件锁内进行，写文件时先写临时文件再rename，避免读到写了一半的文件
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = FileLock(path + '.lock')
+
+    def load(self):
+        try:
+            with open(self.path + '.meta') as f:
+                meta = json.load(f)
+            with open(self.path + '.json') as f:
+                text = f.read()
+        except (OSError, ValueError):
+            return None
+
+        try:
+            with open(self.path + '.pickle', 'rb') as f:
+                data = pickle.load(f)
+        except Exception:
+            data = None
+
+        return SchemaCacheEntry(text, data, meta)
+
+    def store(self, text, schema_url, headers, data):
+        meta = {
+            'schema_url': schema_url,
+            'etag': headers.get('ETag'),
+            'last_modified': headers.get('Last-Modified'),
+            'fetched': time.time()
+        }
+        _atomic_write(self.path + '.json', text.encode('utf-8'))
+        _atomic_write(self.path + '.pickle',
+                      pickle.dumps(data, pickle.HIGHEST_PROTOCOL))
+        _atomic_write(self.path + '.meta', json.dumps(meta).encode('utf-8'))
+
+    def touch(self, entry):
+        entry.meta['fetched'] = time.time()
+        _atomic_write(self.path + '.meta', json.dumps(entry.meta).encode('utf-8'))
+
+
+class SchemaCacheEntry(object):
+    def __init__(self, text, data, meta):
+        self.text = text
+        self.data = data
+        self.meta = meta
+
+    @property
+    def schema_url(self):
+        return self.meta.get('schema_url')
+
+    def age(self):
+        return time.time() - self.meta.get('fetched', 0)
+
+    # 用于条件请求的头部
+    def validators(self):
+        headers = {}
+        if self.meta.get('etag'):
+            headers['If-None-Match'] = self.meta['etag']
+        if self.meta.get('last_modified'):
+            headers['If-Modified-Since'] = self.meta['last_modified']
+        return headers
+
+
+def _atomic_write(path, data):
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path),
+                               prefix='.' + os.path.basename(path))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+class ResponseCache(object):
+    """
+    按url缓存不带查询参数的GET结果(by_id/reload/get)，LRU淘汰。
+    再次请求时携带If-None-Match(响应的ETag或资源的resourceVersion)/If-Modified-Since，
+    服务端返回304时重新解析缓存的响应体，每次返回新的对象，调用方对返回对象的修改不会影响缓存。
+    """
+
+    def __init__(self, max_size=DEFAULT_RESPONSE_CACHE_SIZE):
+        self._max_size = max_size
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, url):
+        with self._lock:
+            entry = self._entries.get(url)
+            if entry is not None:
+                self._entries.move_to_end(url)
+            return entry
+
+    def put(self, url, headers, text, obj):
+        validators = {}
+        etag = headers.get('ETag') or _resource_version(obj)
+        if etag:
+            validators['If-None-Match'] = etag
+        if headers.get('Last-Modified'):
+            validators['If-Modified-Since'] = headers['Last-Modified']
+        if not validators:
+            return
+
+        with self._lock:
+            self._entries[url] = ResponseCacheEntry(validators, text)
+            self._entries.move_to_end(url)
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, url):
+        # action等请求带有查询参数，按去掉查询参数后的url失效
+        with self._lock:
+            self._entries.pop(url.split('?', 1)[0], None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class ResponseCacheEntry(object):
+    def __init__(self, validators, text):
+        self.validators = validators
+        self.text = text
+
+
+def _resource_version(obj):
+    # k8s资源的resourceVersion作为弱ETag
+    if not isinstance(obj, RestObject):
+        return None
+    version = obj.__dict__.get('resourceVersion')
+    metadata = obj.__dict__.get('metadata')
+    if version is None and isinstance(metadata, RestObject):
+        version = metadata.__dict__.get('resourceVersion')
+    if version is None:
+        return None
+    return 'W/"{}"'.format(version)
+
+
+class SingleFlight(object):
+    """
+    合并并发的相同请求：同一个key同时只有一个线程发起请求，其他线程等待并共享同一个结果(或异常)。
+    共享的结果是同一个对象，调用方不应修改
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn, *args):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = SingleFlightCall()
+
+        if not leader:
+            if not call.done.wait(deadline.remaining()):
+                deadline.current().check()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+
+class SingleFlightCall(object):
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
 class ApiError(Exception):
     def __init__(self, obj):
         self.error = obj
@@ -244,10 +698,30 @@ class ClientApiError(Exception):
     pass
 
 
+class BulkResult(list):
+    """
+    批量操作(by_id_many/create_many/delete_many)的结果，顺序与输入一致，
+    请求失败的位置上是对应的ApiError，不会因为某一个失败而中断其他请求
+    """
+
+    @property
+    def errors(self):
+        return {i: r for i, r in enumerate(self) if isinstance(r, ApiError)}
+
+    def raise_for_errors(self, ignore_status=()):
+        for e in self.errors.values():
+            if e.error.status not in ignore_status:
+                raise e
+
+
 class Client(object):
     def __init__(self, access_key=None, secret_key=None, url=None, cache=False,
                  cache_time=86400, strict=False, headers=None, token=None,
-                 verify=True, **kw):
+                 verify=True, shared_schema=False, subscribe=SUBSCRIBE,
+                 response_cache=False, codec=None, retry=None, timeout=None,
+                 pool_connections=None, pool_maxsize=None, http2=None,
+                 single_flight=SINGLE_FLIGHT, track_changes=TRACK_CHANGES,
+                 schema_module=SCHEMA_MODULE, **kw):
         if verify == 'False':
             verify = False
         self._headers = HEADERS.copy()
@@ -267,13 +741,65 @@ class Client(object):
         self._cache = cache
         self._cache_time = cache_time
         self._strict = strict
+        self._shared_schema = shared_schema
+        self._subscription = None
+        # response_cache为True或缓存条数时开启GET的条件请求缓存
+        if response_cache:
+            self._response_cache = ResponseCache(
+                DEFAULT_RESPONSE_CACHE_SIZE if response_cache is True else response_cache)
+        else:
+            self._response_cache = None
+        # json编解码实现，默认安装了orjson时使用orjson
+        self._codec = get_codec(codec)
+        # 重试策略，见common/retry.py
+        self._retry = get_retry_policy(retry)
+        # (连接超时, 读超时)或同时作为两者的秒数
+        if timeout is None:
+            timeout = (CONNECT_TIMEOUT, READ_TIMEOUT)
+        elif not isinstance(timeout, tuple):
+            timeout = (timeout, timeout)
+        self._timeout = timeout
+        # 连接池配置相同的Client共享同一个HTTPAdapter，见common/transport.py
+        self._pool_connections = pool_connections
+        self._pool_maxsize = pool_maxsize
+        self._http2 = http2
+        # 开启后并发的相同GET共享同一个请求和解析结果
+        self._single_flight = SingleFlight() if single_flight else None
+        # 开启后解析的资源都记录原始数据，也可以通过track(obj)单独记录，见common/changes.py
+        self._track_changes = track_changes
+        self._tracker = changes.ChangeTracker()
+        # 生成的schema模块(模块或模块名)，使用时资源按模块中的类型类创建，见common/codegen.py
+        self._schema_module = schema_module
+        self._typed_classes = None
+        self._typed_methods = {}
         self.schema = None
-        self._session = requests.Session()
-        self._session.verify = verify
+        self._session = self._new_session(verify)
+        self._resource_class = type('Resource', (Resource,),
+                                    {'_client': self, '__slots__': ()})
+        self._layouts = {}
 
         if not self._cache_time:
             self._cache_time = 60 * 60 * 24  # 24 Hours
 
+        self._init_schemas()
+
+        # 回放时没有可用的订阅连接
+        if subscribe and not cassette.replaying():
+            self.subscribe()
+
+    def _new_session(self, verify):
+        session = requests.Session()
+        session.verify = verify
+        transport.mount(session, self._pool_connections, self._pool_maxsize)
+        # 开启录制/回放时请求经过cassette，见common/cassette.py
+        return cassette.mount(session)
+
+    def pool_stats(self):
+        """连接池统计，每个host一条：created已创建的连接数，in_use使用中的连接数，idle空闲连接数"""
+        return transport.get_adapter(self._pool_connections, self._pool_maxsize,
+                                     self._session.verify, self._session.cert).pool_stats()
+
+    def _init_schemas(self):
         self._load_schemas()
 
     def valid(self):
@@ -284,47 +810,54 @@ class Client(object):
             return [self.object_hook(x) for x in obj]
 
         if isinstance(obj, dict):
-            result = RestObject()
-
-            # 给RestObject对象赋值
-            for k, v in obj.items():
-                setattr(result, k, self.object_hook(v))
+            # 带type的资源和分页集合使用Resource，links、actions、next/prev在访问时才解析
+            type_name = obj.get('type')
+            if isinstance(type_name, str):
+                result = self._layout_class(type_name, tuple(obj))()
+            elif 'pagination' in obj:
+                result = self._resource_class()
+            else:
+                result = RestObject()
 
-            for link in ['next', 'prev']:
-                try:
-                    url = getattr(result.pagination, link)
-                    if url is not None:
-                        setattr(result, link, lambda url=url: self._get(url))
-                except AttributeError:
-                    pass
-
-            if hasattr(result, 'type') and isinstance(getattr(result, 'type'), str):
-                if hasattr(result, 'links'):
-                    for link_name, link in result.links.items():
-                        def cb_link(_link=link, **kw):
-                            return self._get(_link, data=kw)
-
-                        if hasattr(result, link_name):
-                            setattr(result, link_name + '_link', cb_link)
-                        else:
-                            setattr(result, link_name, cb_link)
-
-                if hasattr(result, 'actions'):
-                    for link_name, link in result.actions.items():
-                        def cb_action(_link_name=link_name, _result=result,
-                                      *args, **kw):
-                            return self.action(_result, _link_name,
-                                               *args, **kw)
-
-                        if hasattr(result, link_name):
-                            setattr(result, link_name + '_action', cb_action)
-                        else:
-                            setattr(result, link_name, cb_action)
+            # 给RestObject对象赋值，标量直接赋值，dict/list递归转换
+            hook = self.object_hook
+            result.__dict__.update({
+                k: hook(v) if isinstance(v, (dict, list)) else v
+                for k, v in obj.items()})
+            if self._track_changes and isinstance(type_name, str) and \
+                    type_name not in changes.UNTRACKED_TYPES:
+                self._tracker.track(result, obj)
 
             return result
 
         return obj
 
+    def _layout_class(self, type_name, fields):
+        # 相同type和字段顺序的资源共用一个Resource子类，实例的属性字典可以共享key表
+        key = (type_name, fields)
+        cls = self._layouts.get(key)
+        if cls is None:
+            if len(self._layouts) >= MAX_LAYOUTS:
+                return self._resource_class
+            attrs = dict(self._typed_attrs(type_name))
+            attrs.update({'__slots__': (), '_fields': fields,
+                          '_field_set': frozenset(fields),
+                          '_public_fields': tuple(k for k in fields if not k.startswith('_'))})
+            cls = type('Resource', (self._resource_class,), attrs)
+            self._layouts[key] = cls
+        return cls
+
+    def _typed_attrs(self, type_name):
+        # 使用生成的schema模块时，模块中对应类型类的方法直接复制到布局类上，不增加继承层级
+        typed = self._typed_classes.get(type_name) if self._typed_classes else None
+        if typed is None:
+            return {}
+        attrs = self._typed_methods.get(type_name)
+        if attrs is None:
+            attrs = {k: v for k, v in vars(typed).items() if callable(v) and not k.startswith('_')}
+            self._typed_methods[type_name] = attrs
+        return attrs
+
     def object_pairs_hook(self, pairs):
         ret = collections.OrderedDict()
         for k, v in pairs:
@@ -332,135 +865,374 @@ class Client(object):
         return self.object_hook(ret)
 
     def _get(self, url, data=None):
+        if self._single_flight is not None:
+            key = (url, json.dumps(data, sort_keys=True, default=str) if data else None)
+            return self._single_flight.do(key, self._get_once, url, data)
+        return self._get_once(url, data)
+
+    def _get_once(self, url, data=None):
+        if self._response_cache is not None and not data:
+            return self._get_cached(url)
         return self._unmarshall(self._get_raw(url, data=data))
 
+    def _get_cached(self, url):
+        # 携带缓存的ETag请求，返回304时重新解析缓存的响应体，省去响应体的传输
+        entry = self._response_cache.get(url)
+        r = self.__get_conditional(url, entry.validators if entry else {})
+        if r.status_code == 304 and entry is not None:
+            return self._unmarshall(entry.text)
+
+        obj = self._unmarshall(r.text)
+        self._response_cache.put(url, r.headers, r.text, obj)
+        return obj
+
     def _error(self, text):
         raise ApiError(self._unmarshall(text))
 
-    @timed_url
+    def _send(self, method, url, **kw):
+        # 按RetryPolicy重试429/502/503和连接错误，重试间隔为指数退避加随机抖动
+        retry = self._retry
+        retry.request()
+        replayable = _replayable(kw)
+        attempt = 0
+        while True:
+            kw['timeout'] = self._request_timeout()
+            try:
+                with self._governor_slot(method, url):
+                    r = self._timed_request(method, url, kw)
+            except RETRY_EXCEPTIONS as e:
+                delay = retry.delay(attempt)
+                if not replayable or \
+                        not retry.retry_error(method, attempt) or \
+                        deadline.remaining(delay) < delay:
+                    raise
+                logger.warning('%s %s failed: %s, retry in %.2fs', method, url, e, delay)
+            else:
+                delay = retry.delay(attempt, r.headers)
+                if not replayable or \
+                        not retry.retry_status(method, r.status_code, attempt) or \
+                        deadline.remaining(delay) < delay:
+                    return r
+                logger.warning('%s %s returned %s, retry in %.2fs',
+                               method, url, r.status_code, delay)
+            cassette.sleep(delay)
+            attempt += 1
+
+    def _timed_request(self, method, url, kw):
+        # 记录每次http请求各阶段的耗时，见common/metrics.py
+        key = self._metrics_endpoint(method, url)
+        started = metrics.start()
+        try:
+            r = self._session.request(method, url, **kw)
+        except Exception:
+            metrics.failed(key, started)
+            raise
+        metrics.response(key, started, started + r.elapsed.total_seconds(),
+                         len(r.content), r.status_code)
+        return r
+
+    def _metrics_endpoint(self, method, url):
+        collections = self.schema.collection_urls() if self.schema is not None else ()
+        return metrics.endpoint(method, url, collections)
+
+    def _governor_slot(self, method, url):
+        # 多个worker共享的限速和并发控制，未配置时不做任何限制，见common/governor.py
+        gov = governor.get_governor()
+        if gov is None:
+            return contextlib.nullcontext()
+        collections = self.schema.collection_urls() if self.schema is not None else ()
+        return gov.slot(governor.endpoint_class(method, url, collections))
+
+    def _request_timeout(self):
+        # 每个请求的超时不超过当前deadline的剩余时间，已经超时时直接抛出DeadlineExceeded
+        connect, read = self._timeout
+        remaining = deadline.remaining()
+        if remaining is not None:
+            deadline.current().check()
+            connect = remaining if connect is None else min(connect, remaining)
+            read = remaining if read is None else min(read, remaining)
+        return connect, read
+
     def _get_raw(self, url, data=None):
         r = self.__get(url, data=data)
         return r.text
 
     @request
     def __get(self, url, data=None):
-        r = self._session.get(url, auth=self._auth, params=data,
-                              headers=self._headers)
+        r = self._send('GET', url, auth=self._auth, params=data,
+                       headers=self._headers)
 
         if r.status_code < 200 or r.status_code >= 300:
             self._error(r.text)
 
         return r
 
-    @timed_url
+    @request
+    def __get_conditional(self, url, headers):
+        r = self._send('GET', url, auth=self._auth,
+                       headers=dict(self._headers, **headers))
+
+        if r.status_code != 304 and (r.status_code < 200 or r.status_code >= 300):
+            self._error(r.text)
+
+        return r
+
+    # Client自身修改了url对应的资源，使缓存失效
+    def _invalidate(self, url):
+        if self._response_cache is not None:
+            self._response_cache.invalidate(url)
+
     def _post(self, url, data=None):
         # 返回RestObject对象
         return self._unmarshall(self.__post(url, data=data).text)
 
     @request
     def __post(self, url, data=None):
-        r = self._session.post(url, auth=self._auth, data=self._marshall(data),
-                               headers=self._headers)
+        self._invalidate(url)
+        r = self._send('POST', url, auth=self._auth, data=self._marshall(data),
+                       headers=self._headers)
         if r.status_code < 200 or r.status_code >= 300:
             self._error(r.text)
 
         return r
 
-    @timed_url
     def _post_file(self, url, header, data=None):
         return self.__post_file(url, header, data=data)
 
     @request
     def __post_file(self, url, header, data=None):
-        headers = copy.deepcopy(self._headers)
-        headers.update(header)
-        r = self._session.post(url, data=data,
-                               headers=headers)
+        self._invalidate(url)
+        r = self._send('POST', url, auth=self._auth, data=data,
+                       headers=dict(self._headers, **header))
         if r.status_code < 200 or r.status_code >= 300:
             self._error(r.text)
 
         return r
 
-    @timed_url
+    def upload_file(self, url, path, field='file', fields=None, filename=None,
+                    content_type='application/octet-stream', progress=None,
+                    chunk_size=None, offset=0, headers=None):
+        """
+        流式上传文件(chart包、镜像、离线包等)，文件按块从磁盘读取，内存占用与文件大小无关
+        :param fields: 其他表单字段
+        :param progress: 进度回调progress(已上传字节数, 文件总字节数)
+        :param chunk_size: 分块上传的块大小，每块一个带Content-Range头的请求，需要接口支持
+        :param offset: 分块上传时从offset开始续传，见UploadInterrupted.offset
+        :return: 最后一个请求的响应
+        """
+        size = os.path.getsize(path)
+        if not chunk_size:
+            with upload.FileSlice(path) as part:
+                body = upload.encoder(part, field, fields, filename, content_type,
+                                      progress=progress)
+                return self._post_file(url, dict(headers or {}, **{'Content-Type': body.content_type}),
+                                       data=body)
+
+        r = None
+        for start, length in upload.chunks(size, chunk_size, offset):
+            r = self._upload_chunk(url, path, field, fields, filename, content_type,
+                                   progress, start, length, size, headers)
+        return r
+
+    def _upload_chunk(self, url, path, field, fields, filename, content_type,
+                      progress, start, length, size, headers):
+        # 单个分块可以安全地重试，失败时抛出UploadInterrupted以便续传
+        attempt = 0
+        while True:
+            try:
+                with upload.FileSlice(path, start, length) as part:
+                    body = upload.encoder(part, field, fields, filename, content_type,
+                                          progress, size)
+                    header = dict(headers or {}, **{
+                        'Content-Type': body.content_type,
+                        'Content-Range': upload.content_range(start, length, size)})
+                    return self._post_file(url, header, data=body)
+            except (ApiError,) + RETRY_EXCEPTIONS as e:
+                status = getattr(getattr(e, 'error', None), 'status', None)
+                if status is not None:
+                    retry = self._retry.retry_status('PUT', status, attempt)
+                else:
+                    retry = self._retry.retry_error('PUT', attempt)
+                if not retry:
+                    raise upload.UploadInterrupted(start, e)
+            cassette.sleep(self._retry.delay(attempt))
+            attempt += 1
+
     def _put(self, url, data=None):
         return self._unmarshall(self.__put(url, data=data).text)
 
     @request
     def __put(self, url, data=None):
-        r = self._session.put(url, auth=self._auth, data=self._marshall(data),
-                              headers=self._headers)
+        self._invalidate(url)
+        r = self._send('PUT', url, auth=self._auth, data=self._marshall(data),
+                       headers=self._headers)
 
         if r.status_code < 200 or r.status_code >= 300:
             self._error(r.text)
 
         return r
 
-    @timed_url
     def _delete(self, url):
         return self._unmarshall(self.__delete(url).text)
 
     @request
     def __delete(self, url):
-        r = self._session.delete(url, auth=self._auth, headers=self._headers)
+        self._invalidate(url)
+        r = self._send('DELETE', url, auth=self._auth, headers=self._headers)
 
         if r.status_code < 200 or r.status_code >= 300:
             self._error(r.text)
 
         return r
 
-    """
-    使用object_pairs_hook和object_hook可以用于实现自定义的解码器:返回自定义的对象。
-    object_pairs_hook 的传入参数是有序的键值对表，而 object_hook 是无序的dict。
-    两个参数都给的话，object_pairs_hook 的优先级要更高。
-    """
     def _unmarshall(self, text):
         if text is None or text == '':
             return text
-        obj = json.loads(text, object_hook=self.object_hook,
-                         object_pairs_hook=self.object_pairs_hook)
-        return obj
+        # 先解析为普通的dict/list，再一次遍历转换为RestObject/Resource
+        start = time.perf_counter()
+        data = self._codec.loads(text)
+        parsed = time.perf_counter()
+        result = self.object_hook(data)
+        metrics.parsed(parsed - start, time.perf_counter() - parsed)
+        return result
 
     def _marshall(self, obj, indent=None, sort_keys=False):
         if obj is None:
             return None
-        return json.dumps(self._to_dict(obj), indent=indent, sort_keys=True)
+        return serializer.dumps(obj, self._codec, indent=indent, sort_keys=sort_keys)
 
     def _load_schemas(self, force=False):
         if self.schema and not force:
             return
 
-        schema_text = self._get_cached_schema()
+        if not force and self._schema_module is not None and \
+                self._use_schema_module(self._server_version()):
+            return
 
-        if force or not schema_text:
+        if not force and self._use_shared_schema(self._url):
+            return
+
+        cache = self._get_schema_cache(self._schema_user()) if self._cache else None
+        if cache is None:
             response = self.__get(self._url)
             # 获取 Schema 的 URL 在每个 HTTP 响应中的X-Api-Schemas头里
             schema_url = response.headers.get('X-API-Schemas')
+            if not force and self._use_shared_schema(self._url, schema_url):
+                return
             if schema_url is not None and self._url != schema_url:
-                schema_text = self._get_raw(schema_url)
-            else:
-                schema_text = response.text
-            self._cache_schema(schema_text)
+                response = self.__get(schema_url)
+            self._set_schema(response.text, schema_url)
+            return
 
-        # 将读取的text转换为RestObject对象
-        obj = self._unmarshall(schema_text)
+        # 多个进程共享同一份缓存文件，在文件锁内读写，保证同一时间只有一个进程请求schema
+        with cache.lock:
+            entry = None if force else cache.load()
+            if entry is not None and entry.age() < self._cache_time:
+                self._set_schema(entry.text, entry.schema_url, entry.data)
+                return
+
+            if entry is not None:
+                # 缓存过期后通过If-None-Match/If-Modified-Since确认schema是否有变化
+                schema_url = entry.schema_url
+                response = self.__get_conditional(schema_url, entry.validators())
+                if response.status_code == 304:
+                    cache.touch(entry)
+                    self._set_schema(entry.text, schema_url, entry.data)
+                    return
+            else:
+                response = self.__get(self._url)
+                schema_url = response.headers.get('X-API-Schemas') or self._url
+                if self._url != schema_url:
+                    response = self.__get(schema_url)
+
+            data = json.loads(response.text)
+            cache.store(response.text, schema_url, response.headers, data)
+            self._set_schema(response.text, schema_url, data)
+
+    def _server_version(self):
+        origin = _origin(self._url)
+        version = _SERVER_VERSIONS.get(origin)
+        if version is None:
+            try:
+                version = self._codec.loads(self._get_raw(origin + SERVER_VERSION_PATH))['value']
+            except (ApiError, ValueError, KeyError, TypeError) + RETRY_EXCEPTIONS:
+                return None
+            _SERVER_VERSIONS[origin] = version
+        return version
+
+    def _use_schema_module(self, version):
+        # 生成模块的api路径和KM版本与当前KM一致时使用模块中的schema，不一致时请求schema
+        module = self._schema_module
+        if isinstance(module, str):
+            module = importlib.import_module(module)
+        path = urlsplit(self._url).path.rstrip('/')
+        if module.SCHEMA_PATH != path:
+            # project/cluster等其他api路径的client本来就不使用该模块
+            logger.debug('schema module %s is for %s, not %s, loading schema',
+                         module.__name__, module.SCHEMA_PATH, self._url)
+            return False
+        if module.SERVER_VERSION is None or module.SERVER_VERSION != version:
+            logger.warning('schema module %s (%s) does not match %s (%s), loading schema',
+                           module.__name__, module.SERVER_VERSION, self._url, version)
+            return False
+
+        schema = _module_schema(self, module, _origin(self._url))
+        self._typed_classes = module.TYPES
+        self._typed_methods = {}
+        self._layouts = {}
+        self._bind_methods(schema)
+        self.schema = schema
+        return True
+
+    def _use_shared_schema(self, url, schema_url=None):
+        # 从进程内共享的schema缓存中获取已解析的schema
+        if not self._shared_schema:
+            return False
+
+        identity = self._schema_identity()
+        if schema_url is None:
+            schema = SCHEMA_REGISTRY.lookup(url, identity)
+        else:
+            schema = SCHEMA_REGISTRY.get(schema_url, identity)
+        if schema is None:
+            return False
+
+        if schema_url is not None:
+            SCHEMA_REGISTRY.register(url, schema_url, schema, identity)
+        self._bind_methods(schema)
+        self.schema = schema
+        return True
+
+    def _set_schema(self, schema_text, schema_url=None, data=None):
+        # 将读取的text或缓存中预解析的数据转换为RestObject对象
+        if data is None:
+            obj = self._unmarshall(schema_text)
+        else:
+            obj = self.object_hook(data)
 
         schema = Schema(schema_text, obj)
 
         if len(schema.types) > 0:
+            if self._shared_schema:
+                SCHEMA_REGISTRY.register(self._url, schema_url or self._url, schema,
+                                         self._schema_identity())
             self._bind_methods(schema)
             self.schema = schema
 
     def reload_schema(self):
         self._load_schemas(force=True)
 
-    def by_id(self, type, id, **kw):
-        # 按照Schema上的collection链接来获取资源
-        id = str(id)
+    def _resource_url(self, type, id):
+        # 按照Schema上的collection链接拼接资源的url
         url = self.schema.types[type].links.collection
         if url.endswith('/'):
             url += id
         else:
             url = '/'.join([url, id])
+        return url
+
+    def by_id(self, type, id, **kw):
+        url = self._resource_url(type, str(id))
         try:
             return self._get(url, self._to_dict(**kw))
         except ApiError as e:
@@ -470,43 +1242,84 @@ class Client(object):
                 raise e
 
     def update_by_id(self, type, id, *args, **kw):
-        url = self.schema.types[type].links.collection
-        if url.endswith('/'):
-            url = url + id
-        else:
-            url = '/'.join([url, id])
-
+        url = self._resource_url(type, id)
         return self._put_and_retry(url, *args, **kw)
 
     def update(self, obj, *args, **kw):
         url = obj.links.self
+        if not args and not kw and self._tracker.original(obj) is not None:
+            args = (obj,)
         return self._put_and_retry(url, *args, **kw)
 
+    def track(self, obj):
+        """
+        记录obj当前的数据，之后update(obj)/update(obj, obj)只发送修改过的字段，
+        track_changes开启时解析出的资源已经自动记录
+        """
+        self._tracker.track(obj, self._to_value(obj))
+        return obj
+
     def _put_and_retry(self, url, *args, **kw):
-        retries = kw.get('retries', 3)
-        for i in range(retries):
-            try:
-                return self._put(url, data=self._to_dict(*args, **kw))
-            except ApiError as e:
-                if i == retries - 1:
-                    raise e
-                if e.error.status == 409:
-                    time.sleep(.1)
-                else:
-                    raise e
+        tracked = self._tracked_update(args, kw)
+        if tracked is None:
+            return self._retry_conflict(self._put, url, self._to_dict(*args, **kw))
+
+        values, patch, explicit = tracked
+
+        # 409冲突后重新获取资源，在最新的数据上重新应用修改过的字段
+        def refresh():
+            return changes.body(self._codec.loads(self._get_raw(url)), patch, explicit)
+
+        result = self._retry_conflict(self._put, url, changes.body(values, patch, explicit),
+                                      refresh)
+        self._track_updated(args)
+        return result
+
+    def _tracked_update(self, args, kw):
+        # 参数中有被跟踪的资源时，返回(本地数据, 修改过的字段的merge patch, 直接指定的字段)
+        values = {}
+        patch = {}
+        explicit = {}
+        tracked = False
+        for i in args:
+            value = self._to_value(i)
+            original = self._tracker.original(i) if isinstance(i, RestObject) else None
+            if original is None:
+                if isinstance(value, dict):
+                    explicit.update(value)
+                continue
+            tracked = True
+            values.update(value)
+            patch.update(changes.diff(original, value))
+        if not tracked:
+            return None
+        for k, v in kw.items():
+            explicit[k] = self._to_value(v)
+        return values, patch, explicit
+
+    def _track_updated(self, args):
+        # 更新成功后以当前数据作为新的原始数据，之后只发送再次修改的字段
+        for i in args:
+            if isinstance(i, RestObject) and self._tracker.original(i) is not None:
+                self._tracker.track(i, self._to_value(i))
 
     def _post_and_retry(self, url, *args, **kw):
-        retries = kw.get('retries', 3)
-        for i in range(retries):
+        return self._retry_conflict(self._post, url, self._to_dict(*args, **kw))
+
+    def _retry_conflict(self, fn, url, data, refresh=None):
+        # update/action遇到409冲突时按RetryPolicy退避后重试，refresh返回重试时使用的请求体
+        attempt = 0
+        while True:
             try:
-                return self._post(url, data=self._to_dict(*args, **kw))
+                return fn(url, data=data)
             except ApiError as e:
-                if i == retries - 1:
-                    raise e
-                if e.error.status == 409:
-                    time.sleep(.1)
-                else:
+                if e.error.status != CONFLICT_STATUS or \
+                        not self._retry.retry_conflict(attempt):
                     raise e
+            cassette.sleep(self._retry.delay(attempt))
+            attempt += 1
+            if refresh is not None:
+                data = refresh()
 
     def _validate_list(self, type, **kw):
         if not self._strict:
@@ -533,6 +1346,25 @@ class Client(object):
         collection_url = self.schema.types[type].links.collection
         return self._get(collection_url, data=self._to_dict(**kw))
 
+    def iter_list(self, type, page_size=None, prefetch=1, keep_pages=False, **kw):
+        """
+        逐条迭代集合中的所有资源，按pagination.next自动翻页
+        :param type: 资源类型
+        :param page_size: 每页数量，对应查询参数limit
+        :param prefetch: 后台预取的页数，当前页被消费时后台线程已经在请求后续的页；为0时在需要时才请求下一页
+        :param keep_pages: 是否保留已消费的页(ListIterator.pages)，默认不保留，内存中最多只有prefetch+1页
+        :param kw: 过滤条件，同list
+        """
+        if type not in self.schema.types:
+            raise ClientApiError(type + ' is not a valid type')
+
+        self._validate_list(type, **kw)
+        if page_size is not None:
+            kw['limit'] = page_size
+        collection_url = self.schema.types[type].links.collection
+        return ListIterator(self, collection_url, self._to_dict(**kw),
+                            prefetch=prefetch, keep_pages=keep_pages)
+
     def reload(self, obj):
         return self.by_id(obj.type, obj.id)
 
@@ -556,6 +1388,38 @@ class Client(object):
         url = getattr(obj.actions, action_name)
         return self._post_and_retry(url, *args, **kw)
 
+    def by_id_many(self, type, ids, concurrency=DEFAULT_BULK_CONCURRENCY, **kw):
+        return self._run_many(lambda id: self.by_id(type, id, **kw), ids,
+                              concurrency)
+
+    def create_many(self, type, items, concurrency=DEFAULT_BULK_CONCURRENCY):
+        # items中的每个元素为创建资源的参数(dict或RestObject)
+        return self._run_many(lambda item: self.create(type, item), items,
+                              concurrency)
+
+    def delete_many(self, objs, concurrency=DEFAULT_BULK_CONCURRENCY):
+        return self._run_many(self.delete, objs, concurrency)
+
+    # 在线程池中并发执行fn，返回与items顺序一致的BulkResult
+    def _run_many(self, fn, items, concurrency):
+        items = list(items)
+        result = BulkResult([None] * len(items))
+        if not items:
+            return result
+
+        def run(i):
+            try:
+                result[i] = fn(items[i])
+            except ApiError as e:
+                result[i] = e
+
+        # 工作线程继承调用方的deadline
+        context = contextvars.copy_context()
+        with ThreadPoolExecutor(max_workers=min(concurrency, len(items))) as pool:
+            for f in [pool.submit(context.copy().run, run, i) for i in range(len(items))]:
+                f.result()
+        return result
+
     def get(self, obj):
         try:
             return self._get(obj.links.self)
@@ -581,58 +1445,29 @@ class Client(object):
 
         return False
 
-    # 私有方法，将一个对象转换为字典类型的数据。
-    # 如果对象是字典类型，则递归调用 _to_value 方法将字典中的每个值都转换为字典类型的数据。
-    # 如果对象是列表类型，则递归调用 _to_value 方法将列表中的每个元素都转换为字典类型的数据。
-    # 如果对象是 RestObject 类型，则将 RestObject 类型的对象转换为字典类型的数据。
+    # 将对象转换为dict/list/标量组成的数据，不递归，见common/serializer.py
     def _to_value(self, value):
-        if isinstance(value, dict):
-            ret = {}
-            for k, v in value.items():
-                ret[k] = self._to_value(v)
-            return ret
-
-        if isinstance(value, list):
-            ret = []
-            for v in value:
-                ret.append(self._to_value(v))
-            return ret
-
-        if isinstance(value, RestObject):
-            ret = {}
-            # 遍历 RestObject 类型的对象的属性，通过判断 k.startswith('_') 来排除私有属性，只将公共属性转换为字典类型的数据。
-            for k, v in vars(value).items():
-                if not k.startswith('_') and \
-                        not isinstance(v, RestObject) and not callable(v):
-                    ret[k] = self._to_value(v)
-                elif not k.startswith('_') and isinstance(v, RestObject):
-                    ret[k] = self._to_dict(v)
-            return ret
-
-        return value
-
-    # 私有方法，用于将多个对象转换为一个字典类型的数据。
-    # 如果只有一个参数且为列表类型，则递归调用 _to_dict 方法将列表中的每个元素都转换为字典类型的数据，并返回一个字典类型的列表。
-    # 否则，将所有参数和关键字参数都转换为字典类型的数据，并返回一个字典类型的数据。
-    # 在转换参数和关键字参数时，需要递归调用 _to_value 方法将嵌套的 RestObject 类型的对象也转换为字典类型的数据。
+        return serializer.to_value(value)
+
+    # 将多个对象的公共字段合并为一个请求体，参数是列表或集合时返回列表。
+    # 只合并顶层字段，嵌套的RestObject在_marshall时由serializer直接序列化
     def _to_dict(self, *args, **kw):
         if len(kw) == 0 and len(args) == 1 and self._is_list(args[0]):
-            ret = []
-            for i in args[0]:
-                ret.append(self._to_dict(i))
-            return ret
+            return [self._to_dict(i) for i in args[0]]
 
         ret = {}
 
         for i in args:
-            value = self._to_value(i)
-            if isinstance(value, dict):
-                for k, v in value.items():
-                    ret[k] = v
-
-        for k, v in kw.items():
-            ret[k] = self._to_value(v)
-
+            if isinstance(i, RestObject):
+                d = i.__dict__
+                for k in serializer.public_fields(i):
+                    v = d[k]
+                    if not callable(v):
+                        ret[k] = v
+            elif isinstance(i, dict):
+                ret.update(i)
+
+        ret.update(kw)
         return ret
 
     @staticmethod
@@ -646,100 +1481,734 @@ class Client(object):
 
     # schema和method绑定
     def _bind_methods(self, schema):
-        bindings = [
-            ('list', 'collectionMethods', GET_METHOD, self.list),
-            ('by_id', 'collectionMethods', GET_METHOD, self.by_id),
-            ('update_by_id', 'resourceMethods', PUT_METHOD, self.update_by_id),
-            ('create', 'collectionMethods', POST_METHOD, self.create)
-        ]
-
-        for type_name, typ in schema.types.items():
-            for name_variant in self._type_name_variants(type_name):
-                for method_name, type_collection, test_method, m in bindings:
-                    def cb_bind(type_name=type_name, method=m):
-                        def _cb(*args, **kw):
-                            return method(type_name, *args, **kw)
-
-                        return _cb
-
-                    if test_method in getattr(typ, type_collection, []):
-                        setattr(self, '_'.join([method_name, name_variant]),
-                                cb_bind())
-
-    def _get_schema_hash(self):
+        # 方法在第一次访问时由__getattr__生成，schema变化时清除已经生成的方法
+        for name in self.__dict__.pop('_bound', ()):
+            self.__dict__.pop(name, None)
+
+    # list_<type>、by_id_<type>、create_<type>、update_by_id_<type>在访问时按schema的方法表生成，
+    # 生成后保存在实例上，之后的访问不再经过__getattr__
+    def __getattr__(self, k):
+        schema = self.__dict__.get('schema')
+        if schema is not None:
+            entry = schema.method_table().get(k)
+            if entry is not None:
+                method_name, type_name = entry
+                method = functools.partial(getattr(self, method_name), type_name)
+                self.__dict__[k] = method
+                self.__dict__.setdefault('_bound', set()).add(k)
+                return method
+        raise AttributeError("'{}' object has no attribute '{}'".format(type(self).__name__, k))
+
+    def __dir__(self):
+        names = set(super(Client, self).__dir__())
+        schema = self.__dict__.get('schema')
+        if schema is not None:
+            names.update(schema.method_table())
+        return sorted(names)
+
+    def _get_schema_hash(self, user=None):
+        # 磁盘缓存在多次运行、多个worker之间共享，优先使用稳定的用户id，而不是每次登录都不同的token
+        h = hashlib.new('sha1')
+        h.update(self._url.encode('utf-8'))
+        if user is not None:
+            h.update(('user:' + user).encode('utf-8'))
+        else:
+            h.update(self._schema_identity().encode('utf-8'))
+        return h.hexdigest()
+
+    def _schema_user(self):
+        # 使用bearer token时请求token对应的用户id，access key本身是稳定的，不需要请求
+        if self._access_key is not None or 'Authorization' not in self._headers:
+            return None
+        try:
+            text = self._get_raw(_origin(self._url) + CURRENT_USER_PATH)
+            return self._codec.loads(text)['data'][0]['id']
+        except (ApiError, ValueError, KeyError, IndexError, TypeError) + RETRY_EXCEPTIONS:
+            return None
+
+    def _schema_identity(self):
+        # KM按用户权限过滤schema，用access key和Authorization头区分用户，不保存明文token
         h = hashlib.new('sha1')
-        h.update(self._url)
         if self._access_key is not None:
-            h.update(self._access_key)
+            h.update(self._access_key.encode('utf-8'))
+        h.update(b'\0')
+        h.update(str(self._headers.get('Authorization', '')).encode('utf-8'))
         return h.hexdigest()
 
-    def _get_cached_schema_file_name(self):
+    def _get_schema_cache(self, user=None):
         if not self._cache:
             return None
 
-        h = self._get_schema_hash()
+        h = self._get_schema_hash(user)
 
         cachedir = os.path.expanduser(CACHE_DIR)
         if not cachedir:
             return None
 
-        if not os.path.exists(cachedir):
-            os.mkdir(cachedir)
+        os.makedirs(cachedir, exist_ok=True)
 
-        return os.path.join(cachedir, 'schema-' + h + '.json')
+        return SchemaCache(os.path.join(cachedir, 'schema-' + h))
 
-    def _cache_schema(self, text):
-        cached_schema = self._get_cached_schema_file_name()
-
-        if not cached_schema:
+    def subscribe(self, url=None):
+        """
+        打开/v3/subscribe websocket，之后wait_*等待资源时由推送的事件唤醒，而不是定时轮询
+        :param url: websocket地址，默认使用schema中subscribe的地址
+        """
+        if self._subscription is None:
+            self._subscription = SubscriptionManager(self, url=url).start()
+        return self._subscription
+
+    def unsubscribe(self):
+        if self._subscription is not None:
+            self._subscription.close()
+            self._subscription = None
+
+    def watch(self, type, id):
+        # 未开启订阅时返回None
+        if self._subscription is None:
             return None
+        return self._subscription.watch(type, id)
 
-        with open(cached_schema, 'w') as f:
-            f.write(text)
+    def wait_change(self, type, id, watch=None, sleep=1):
+        """
+        等待资源变化并返回最新的资源，资源被删除时返回None
+        有可用的订阅时等待推送事件，最长等待SUBSCRIBE_FALLBACK_INTERVAL后重新获取资源；否则sleep后重新获取资源
+        """
+        if watch is not None and watch.connected:
+            event = watch.next(deadline.cap(SUBSCRIBE_FALLBACK_INTERVAL))
+            if event is not None:
+                return None if event.name == RESOURCE_REMOVE else event.obj
+        else:
+            cassette.sleep(deadline.cap(sleep))
+        return self.by_id(type, id)
 
-    def _get_cached_schema(self):
-        if not self._cache:
-            return None
+    def wait_success(self, obj, timeout=-1):
+        obj = self.wait_transitioning(obj, timeout)
+        if obj.transitioning != 'no':
+            raise ClientApiError(obj.transitioningMessage)
+        return obj
+
+    def wait_transitioning(self, obj, timeout=-1, sleep=0.01):
+        # 在外层deadline中调用时，等待时间和每个请求的超时都不超过外层的剩余时间
+        timeout = _get_timeout(timeout)
+        start = time.time()
+        with deadline.deadline(timeout) as d:
+            try:
+                watch = self.watch(obj.type, obj.id)
+                obj = self.reload(obj)
+                while obj.transitioning == 'yes':
+                    d.check()
+                    obj = self.wait_change(obj.type, obj.id, watch, sleep)
+                    sleep *= 2
+                    if sleep > 2:
+                        sleep = 2
+            except DEADLINE_ERRORS:
+                # 请求因deadline到期失败时，抛出说明等待对象的超时异常
+                if not d.expired():
+                    raise
+                msg = 'Timeout waiting for [{}:{}] to be done after {} seconds'
+                msg = msg.format(obj.type, obj.id, time.time() - start)
+                raise deadline.DeadlineExceeded(msg)
+
+        return obj
+
+
+class ListIterator(object):
+    """
+    Client.iter_list的返回值，逐条返回集合中的资源。
+    prefetch>0时由后台线程按顺序请求后续的页，放入长度为prefetch的队列中，后台线程继承创建时的deadline和优先级，
+    等待下一页的时间不超过迭代时的deadline；迭代器被关闭(close/with/被回收)后后台线程随之退出。
+    """
+    _END = object()
+
+    def __init__(self, client, url, data=None, prefetch=1, keep_pages=False):
+        self.pages = []
+        self._keep_pages = keep_pages
+        self._items = collections.deque()
+        self._stop = threading.Event()
+        self._done = False
+        if prefetch > 0:
+            self._queue = queue.Queue(maxsize=prefetch)
+            self._thread = threading.Thread(
+                target=contextvars.copy_context().run,
+                args=(_fetch_pages, client, url, data, self._queue, self._stop),
+                daemon=True)
+            self._thread.start()
+            self._pages = None
+        else:
+            self._queue = None
+            self._pages = _iter_pages(client, url, data)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        while not self._items:
+            if self._done:
+                raise StopIteration
+            page = self._next_page()
+            if page is self._END:
+                self._done = True
+                raise StopIteration
+            if self._keep_pages:
+                self.pages.append(page)
+            self._items.extend(page.data)
+        return self._items.popleft()
+
+    def _next_page(self):
+        if self._queue is None:
+            return next(self._pages, self._END)
+
+        timeout = deadline.remaining()
+        try:
+            page = self._queue.get(timeout=None if timeout is None else max(0, timeout))
+        except queue.Empty:
+            deadline.current().check()
+            raise
+        if isinstance(page, BaseException):
+            self._done = True
+            raise page
+        return page
+
+    def close(self):
+        self._done = True
+        self._stop.set()
+        self._items.clear()
+        if self._queue is not None:
+            # 取出队列中的页，避免后台线程阻塞在put上
+            while True:
+                try:
+                    self._queue.get_nowait()
+                except queue.Empty:
+                    break
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def __del__(self):
+        self.close()
+
+
+def _iter_pages(client, url, data=None):
+    while url is not None:
+        page = client._get(url, data=data)
+        data = None
+        yield page
+        pagination = page.__dict__.get('pagination')
+        url = getattr(pagination, 'next', None) if pagination is not None else None
+
+
+# ListIterator的后台线程，不持有ListIterator本身，迭代器被回收时可以正常触发close
+def _fetch_pages(client, url, data, pages, stop):
+    def put(item):
+        while not stop.is_set():
+            try:
+                pages.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    try:
+        for page in _iter_pages(client, url, data):
+            if not put(page):
+                return
+    except BaseException as e:
+        put(e)
+        return
+    put(ListIterator._END)
+
+
+class AsyncClient(Client):
+    """
+    基于httpx的asyncio版本Client，与Client使用同一套schema绑定的接口(list_*, by_id_*, create_*, action, wait_success等)，
+    区别在于所有会发起请求的方法都需要await，例如：
+        async with AsyncClient(url=BASE_URL, token=token, verify=False) as client:
+            ns = await client.by_id_namespace(ns_id)
+            await ns.remove()
+    """
+
+    def __init__(self, *args, **kw):
+        # 订阅依赖后台线程，AsyncClient的等待仍然使用轮询
+        kw['subscribe'] = False
+        super(AsyncClient, self).__init__(*args, **kw)
+
+    def _new_session(self, verify):
+        # 超时由每个请求指定，见Client._request_timeout
+        return transport.async_session(verify, self._pool_maxsize, self._http2)
+
+    async def pool_stats(self):
+        """httpx连接池统计，created为当前打开的连接数"""
+        stats = []
+        info = await self._session._transport.get_connection_info()
+        for origin, connections in info.items():
+            stats.append({
+                'host': origin,
+                'created': len(connections),
+                'in_use': sum(1 for c in connections if 'IDLE' not in c),
+                'idle': sum(1 for c in connections if 'IDLE' in c)
+            })
+        return stats
+
+    def _init_schemas(self):
+        # schema需要在事件循环中加载，见connect/__aenter__
+        pass
+
+    @classmethod
+    async def connect(cls, *args, **kw):
+        client = cls(*args, **kw)
+        await client._load_schemas()
+        return client
+
+    async def close(self):
+        await self._session.aclose()
+
+    async def __aenter__(self):
+        await self._load_schemas()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def _get(self, url, data=None):
+        if self._response_cache is not None and not data:
+            return await self._get_cached(url)
+        return self._unmarshall(await self._get_raw(url, data=data))
+
+    async def _get_cached(self, url):
+        entry = self._response_cache.get(url)
+        r = await self.__get_conditional(url, entry.validators if entry else {})
+        if r.status_code == 304 and entry is not None:
+            return self._unmarshall(entry.text)
+
+        obj = self._unmarshall(r.text)
+        self._response_cache.put(url, r.headers, r.text, obj)
+        return obj
+
+    async def _send(self, method, url, **kw):
+        retry = self._retry
+        retry.request()
+        replayable = _replayable(kw)
+        attempt = 0
+        while True:
+            connect, read = self._request_timeout()
+            kw['timeout'] = httpx.Timeout(read, connect=connect)
+            try:
+                r = await self._governed_request(method, url, **kw)
+            except httpx.TransportError as e:
+                delay = retry.delay(attempt)
+                if not replayable or \
+                        not retry.retry_error(method, attempt) or \
+                        deadline.remaining(delay) < delay:
+                    raise
+                logger.warning('%s %s failed: %s, retry in %.2fs', method, url, e, delay)
+            else:
+                delay = retry.delay(attempt, r.headers)
+                if not replayable or \
+                        not retry.retry_status(method, r.status_code, attempt) or \
+                        deadline.remaining(delay) < delay:
+                    return r
+                logger.warning('%s %s returned %s, retry in %.2fs',
+                               method, url, r.status_code, delay)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def _governed_request(self, method, url, **kw):
+        gov = governor.get_governor()
+        if gov is None:
+            return await self._timed_request(method, url, kw)
+        collections = self.schema.collection_urls() if self.schema is not None else ()
+        endpoint = governor.endpoint_class(method, url, collections)
+        # 获取配额时会等待文件锁，放到线程池中执行
+        acquired = await asyncio.get_event_loop().run_in_executor(
+            None, gov.acquire, endpoint, governor.is_low_priority(), deadline.remaining())
+        try:
+            return await self._timed_request(method, url, kw)
+        finally:
+            if acquired:
+                gov.release(endpoint)
+
+    async def _timed_request(self, method, url, kw):
+        # 流式发送请求，分别记录收到响应头和读取响应体的时间
+        kw = dict(kw)
+        auth = kw.pop('auth', None)
+        timeout = kw.pop('timeout', None)
+        key = self._metrics_endpoint(method, url)
+        started = metrics.start()
+        try:
+            request = self._session.build_request(method, url, **kw)
+            r = await self._session.send(request, stream=True, auth=auth, timeout=timeout)
+            first_byte = time.perf_counter()
+            try:
+                await r.aread()
+            finally:
+                await r.aclose()
+        except Exception:
+            metrics.failed(key, started)
+            raise
+        metrics.response(key, started, first_byte, len(r.content), r.status_code)
+        return r
+
+    async def _get_raw(self, url, data=None):
+        r = await self.__get(url, data=data)
+        return r.text
+
+    @request
+    async def __get(self, url, data=None):
+        r = await self._send('GET', url, auth=self._auth, params=_params(data),
+                             headers=self._headers)
+
+        if r.status_code < 200 or r.status_code >= 300:
+            self._error(r.text)
+
+        return r
+
+    async def _post(self, url, data=None):
+        return self._unmarshall((await self.__post(url, data=data)).text)
+
+    @request
+    async def __post(self, url, data=None):
+        self._invalidate(url)
+        r = await self._send('POST', url, auth=self._auth,
+                             content=self._marshall(data),
+                             headers=self._headers)
+        if r.status_code < 200 or r.status_code >= 300:
+            self._error(r.text)
+
+        return r
+
+    async def _post_file(self, url, header, data=None):
+        return await self.__post_file(url, header, data=data)
+
+    @request
+    async def __post_file(self, url, header, data=None):
+        self._invalidate(url)
+        headers = dict(self._headers, **header)
+        if isinstance(data, dict):
+            r = await self._send('POST', url, auth=self._auth, data=data, headers=headers)
+        else:
+            r = await self._send('POST', url, auth=self._auth, content=data, headers=headers)
+        if r.status_code < 200 or r.status_code >= 300:
+            self._error(r.text)
+
+        return r
+
+    async def upload_file(self, url, path, field='file', fields=None, filename=None,
+                          content_type='application/octet-stream', progress=None,
+                          chunk_size=None, offset=0, headers=None):
+        size = os.path.getsize(path)
+        r = None
+        parts = upload.chunks(size, chunk_size, offset) if chunk_size else [(0, size)]
+        for start, length in parts:
+            try:
+                with upload.FileSlice(path, start, length) as part:
+                    body = upload.encoder(part, field, fields, filename, content_type,
+                                          progress, size)
+                    header = dict(headers or {}, **{'Content-Type': body.content_type,
+                                                    'Content-Length': str(body.len)})
+                    if chunk_size:
+                        header['Content-Range'] = upload.content_range(start, length, size)
+                    r = await self._post_file(url, header, data=upload.iter_async(body))
+            except (ApiError, httpx.TransportError) as e:
+                if not chunk_size:
+                    raise
+                raise upload.UploadInterrupted(start, e)
+        return r
 
-        cached_schema = self._get_cached_schema_file_name()
+    async def _put(self, url, data=None):
+        return self._unmarshall((await self.__put(url, data=data)).text)
 
-        if not cached_schema:
+    @request
+    async def __put(self, url, data=None):
+        self._invalidate(url)
+        r = await self._send('PUT', url, auth=self._auth,
+                             content=self._marshall(data),
+                             headers=self._headers)
+
+        if r.status_code < 200 or r.status_code >= 300:
+            self._error(r.text)
+
+        return r
+
+    async def _delete(self, url):
+        return self._unmarshall((await self.__delete(url)).text)
+
+    @request
+    async def __delete(self, url):
+        self._invalidate(url)
+        r = await self._send('DELETE', url, auth=self._auth,
+                             headers=self._headers)
+
+        if r.status_code < 200 or r.status_code >= 300:
+            self._error(r.text)
+
+        return r
+
+    async def _load_schemas(self, force=False):
+        if self.schema and not force:
+            return
+
+        if not force and self._schema_module is not None and \
+                self._use_schema_module(await self._server_version()):
+            return
+
+        if not force and self._use_shared_schema(self._url):
+            return
+
+        cache = self._get_schema_cache(await self._schema_user()) if self._cache else None
+        if cache is None:
+            response = await self.__get(self._url)
+            schema_url = response.headers.get('X-API-Schemas')
+            if not force and self._use_shared_schema(self._url, schema_url):
+                return
+            if schema_url is not None and self._url != schema_url:
+                response = await self.__get(schema_url)
+            self._set_schema(response.text, schema_url)
+            return
+
+        with cache.lock:
+            entry = None if force else cache.load()
+            if entry is not None and entry.age() < self._cache_time:
+                self._set_schema(entry.text, entry.schema_url, entry.data)
+                return
+
+            if entry is not None:
+                schema_url = entry.schema_url
+                response = await self.__get_conditional(schema_url, entry.validators())
+                if response.status_code == 304:
+                    cache.touch(entry)
+                    self._set_schema(entry.text, schema_url, entry.data)
+                    return
+            else:
+                response = await self.__get(self._url)
+                schema_url = response.headers.get('X-API-Schemas') or self._url
+                if self._url != schema_url:
+                    response = await self.__get(schema_url)
+
+            data = json.loads(response.text)
+            cache.store(response.text, schema_url, response.headers, data)
+            self._set_schema(response.text, schema_url, data)
+
+    @request
+    async def __get_conditional(self, url, headers):
+        r = await self._send('GET', url, auth=self._auth,
+                             headers=dict(self._headers, **headers))
+
+        if r.status_code != 304 and (r.status_code < 200 or r.status_code >= 300):
+            self._error(r.text)
+
+        return r
+
+    async def _server_version(self):
+        origin = _origin(self._url)
+        version = _SERVER_VERSIONS.get(origin)
+        if version is None:
+            try:
+                text = await self._get_raw(origin + SERVER_VERSION_PATH)
+                version = self._codec.loads(text)['value']
+            except (ApiError, ValueError, KeyError, TypeError, httpx.TransportError):
+                return None
+            _SERVER_VERSIONS[origin] = version
+        return version
+
+    async def _schema_user(self):
+        if self._access_key is not None or 'Authorization' not in self._headers:
+            return None
+        try:
+            text = await self._get_raw(_origin(self._url) + CURRENT_USER_PATH)
+            return self._codec.loads(text)['data'][0]['id']
+        except (ApiError, ValueError, KeyError, IndexError, TypeError, httpx.TransportError):
             return None
 
-        if os.path.exists(cached_schema):
-            mod_time = os.path.getmtime(cached_schema)
-            if time.time() - mod_time < self._cache_time:
-                with open(cached_schema) as f:
-                    data = f.read()
-                return data
+    async def reload_schema(self):
+        await self._load_schemas(force=True)
 
-        return None
+    async def by_id(self, type, id, **kw):
+        url = self._resource_url(type, str(id))
+        try:
+            return await self._get(url, self._to_dict(**kw))
+        except ApiError as e:
+            if e.error.status == 404:
+                return None
+            else:
+                raise e
 
-    def wait_success(self, obj, timeout=-1):
-        obj = self.wait_transitioning(obj, timeout)
+    async def update_by_id(self, type, id, *args, **kw):
+        url = self._resource_url(type, id)
+        return await self._put_and_retry(url, *args, **kw)
+
+    async def update(self, obj, *args, **kw):
+        url = obj.links.self
+        if not args and not kw and self._tracker.original(obj) is not None:
+            args = (obj,)
+        return await self._put_and_retry(url, *args, **kw)
+
+    async def _put_and_retry(self, url, *args, **kw):
+        tracked = self._tracked_update(args, kw)
+        if tracked is None:
+            return await self._retry_conflict(self._put, url, self._to_dict(*args, **kw))
+
+        values, patch, explicit = tracked
+
+        async def refresh():
+            return changes.body(self._codec.loads(await self._get_raw(url)), patch, explicit)
+
+        result = await self._retry_conflict(self._put, url,
+                                            changes.body(values, patch, explicit), refresh)
+        self._track_updated(args)
+        return result
+
+    async def _post_and_retry(self, url, *args, **kw):
+        return await self._retry_conflict(self._post, url, self._to_dict(*args, **kw))
+
+    async def _retry_conflict(self, fn, url, data, refresh=None):
+        attempt = 0
+        while True:
+            try:
+                return await fn(url, data=data)
+            except ApiError as e:
+                if e.error.status != CONFLICT_STATUS or \
+                        not self._retry.retry_conflict(attempt):
+                    raise e
+            await asyncio.sleep(self._retry.delay(attempt))
+            attempt += 1
+            if refresh is not None:
+                data = await refresh()
+
+    async def list(self, type, **kw):
+        if type not in self.schema.types:
+            raise ClientApiError(type + ' is not a valid type')
+
+        self._validate_list(type, **kw)
+        collection_url = self.schema.types[type].links.collection
+        return await self._get(collection_url, data=self._to_dict(**kw))
+
+    async def iter_list(self, type, page_size=None, **kw):
+        # async for 逐条迭代，消费当前页时下一页已经在请求中
+        if type not in self.schema.types:
+            raise ClientApiError(type + ' is not a valid type')
+
+        self._validate_list(type, **kw)
+        if page_size is not None:
+            kw['limit'] = page_size
+        collection_url = self.schema.types[type].links.collection
+        task = asyncio.ensure_future(
+            self._get(collection_url, data=self._to_dict(**kw)))
+        try:
+            while task is not None:
+                page = await task
+                pagination = page.__dict__.get('pagination')
+                url = getattr(pagination, 'next', None) if pagination is not None else None
+                task = asyncio.ensure_future(self._get(url)) if url else None
+                items = collections.deque(page.data)
+                del page
+                while items:
+                    yield items.popleft()
+        finally:
+            if task is not None:
+                task.cancel()
+
+    async def reload(self, obj):
+        return await self.by_id(obj.type, obj.id)
+
+    async def create(self, type, *args, **kw):
+        collection_url = self.schema.types[type].links.collection
+        return await self._post(collection_url, data=self._to_dict(*args, **kw))
+
+    async def delete(self, *args):
+        for i in args:
+            if isinstance(i, RestObject):
+                return await self._delete(i.links.self)
+
+    async def action(self, obj, action_name, *args, **kw):
+        url = getattr(obj.actions, action_name)
+        return await self._post_and_retry(url, *args, **kw)
+
+    # by_id_many/create_many/delete_many在AsyncClient中返回coroutine，通过信号量限制并发数
+    async def _run_many(self, fn, items, concurrency):
+        items = list(items)
+        result = BulkResult([None] * len(items))
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def run(i):
+            async with semaphore:
+                try:
+                    result[i] = await fn(items[i])
+                except ApiError as e:
+                    result[i] = e
+
+        await asyncio.gather(*[run(i) for i in range(len(items))])
+        return result
+
+    async def get(self, obj):
+        try:
+            return await self._get(obj.links.self)
+        except ApiError as e:
+            if e.error.status == 404:
+                return None
+            else:
+                raise e
+
+    async def wait_success(self, obj, timeout=-1):
+        obj = await self.wait_transitioning(obj, timeout)
         if obj.transitioning != 'no':
             raise ClientApiError(obj.transitioningMessage)
         return obj
 
-    def wait_transitioning(self, obj, timeout=-1, sleep=0.01):
+    async def wait_transitioning(self, obj, timeout=-1, sleep=0.01):
         timeout = _get_timeout(timeout)
         start = time.time()
-        obj = self.reload(obj)
-        while obj.transitioning == 'yes':
-            time.sleep(sleep)
-            sleep *= 2
-            if sleep > 2:
-                sleep = 2
-            obj = self.reload(obj)
-            delta = time.time() - start
-            if delta > timeout:
+        with deadline.deadline(timeout) as d:
+            try:
+                obj = await self.reload(obj)
+                while obj.transitioning == 'yes':
+                    d.check()
+                    await asyncio.sleep(deadline.cap(sleep))
+                    sleep *= 2
+                    if sleep > 2:
+                        sleep = 2
+                    obj = await self.reload(obj)
+            except DEADLINE_ERRORS:
+                if not d.expired():
+                    raise
                 msg = 'Timeout waiting for [{}:{}] to be done after {} seconds'
-                msg = msg.format(obj.type, obj.id, delta)
-                raise Exception(msg)
+                msg = msg.format(obj.type, obj.id, time.time() - start)
+                raise deadline.DeadlineExceeded(msg)
 
         return obj
 
 
+def _params(data):
+    # requests会丢弃值为None的查询参数，httpx则会转换为空字符串
+    if not data:
+        return None
+    return {k: v for k, v in data.items() if v is not None}
+
+
+_CLIENTS = {}
+_CLIENTS_LOCK = threading.Lock()
+
+
+def get_client(url=None, token=None, verify=True, headers=None, **kw):
+    """
+    Client工厂：共享进程内已加载的schema，url、token等参数相同时直接返回已创建的Client。
+    创建的Client在进程内一直保留，只用于session级别的Client；每个用例的项目url、新用户token等
+    不会重复的Client直接使用rancher.Client
+    """
+    key = (url, token, str(verify), tuple(sorted((headers or {}).items())),
+           tuple(sorted(kw.items())))
+    with _CLIENTS_LOCK:
+        client = _CLIENTS.get(key)
+        if client is None:
+            client = Client(url=url, token=token, verify=verify,
+                            headers=headers, shared_schema=True, **kw)
+            _CLIENTS[key] = client
+        return client
+
+
 def _get_timeout(timeout):
     if timeout == -1:
         return DEFAULT_TIMEOUT
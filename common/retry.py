@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import email.utils
+import os
+import random
+import threading
+import time
+
+# 单个请求的最大重试次数
+DEFAULT_RETRIES = int(os.environ.get('RANCHER_RETRIES') or 3)
+# 退避的初始间隔和最大间隔(秒)
+DEFAULT_BACKOFF = 0.1
+DEFAULT_MAX_BACKOFF = 10
+# Retry-After的最大等待时间(秒)
+MAX_RETRY_AFTER = 60
+# 任何方法都可以重试的状态码：请求被拒绝，服务端没有处理
+RETRY_STATUSES = (429,)
+# 只有幂等方法可以重试的状态码：请求可能已经被处理
+IDEMPOTENT_RETRY_STATUSES = (502, 503, 504)
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE')
+# update/action遇到409冲突时的重试，见Client._put_and_retry/_post_and_retry
+CONFLICT_STATUS = 409
+
+
+class RetryBudget(object):
+    """
+    重试预算：每个请求存入ratio个令牌，每次重试取出一个，令牌不足时不再重试，
+    避免KM故障时所有worker同时大量重试。min_tokens保证请求很少时也能重试。
+    """
+
+    def __init__(self, ratio=0.2, min_tokens=10, max_tokens=100):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self._tokens = float(min_tokens)
+        self._lock = threading.Lock()
+
+    @property
+    def tokens(self):
+        return self._tokens
+
+    def deposit(self):
+        with self._lock:
+            self._tokens = min(self.max_tokens, self._tokens + self.ratio)
+
+    def withdraw(self):
+        with self._lock:
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+
+class RetryPolicy(object):
+    """
+    Client的重试策略：
+    retries      单个请求的最大重试次数
+    backoff      指数退避的初始间隔，第n次重试等待random(0, min(max_backoff, backoff * 2 ** n))秒(full jitter)
+    budget       RetryBudget，同一个RetryPolicy的所有Client共享，None时使用默认的RetryBudget()，False时不限制
+    429按Retry-After等待后重试，502/503/504和连接错误只重试幂等方法(idempotent_methods)
+    """
+
+    def __init__(self, retries=DEFAULT_RETRIES, backoff=DEFAULT_BACKOFF,
+                 max_backoff=DEFAULT_MAX_BACKOFF, budget=None,
+                 statuses=RETRY_STATUSES,
+                 idempotent_statuses=IDEMPOTENT_RETRY_STATUSES,
+                 idempotent_methods=IDEMPOTENT_METHODS):
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.budget = RetryBudget() if budget is None else budget
+        self.statuses = statuses
+        self.idempotent_statuses = idempotent_statuses
+        self.idempotent_methods = idempotent_methods
+
+    def request(self):
+        # 每个请求调用一次，向预算中存入令牌
+        if self.budget:
+            self.budget.deposit()
+
+    def retry_status(self, method, status, attempt):
+        if status in self.statuses:
+            return self._allow(attempt)
+        if status in self.idempotent_statuses and method in self.idempotent_methods:
+            return self._allow(attempt)
+        return False
+
+    def retry_error(self, method, attempt):
+        # 连接错误(连接被重置、读超时等)
+        return method in self.idempotent_methods and self._allow(attempt)
+
+    def retry_conflict(self, attempt):
+        return self._allow(attempt)
+
+    def _allow(self, attempt):
+        if attempt >= self.retries:
+            return False
+        return not self.budget or self.budget.withdraw()
+
+    def delay(self, attempt, headers=None):
+        retry_after = _retry_after(headers)
+        if retry_after is not None:
+            return min(retry_after, MAX_RETRY_AFTER)
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+
+class NoRetry(RetryPolicy):
+    def __init__(self):
+        super(NoRetry, self).__init__(retries=0, budget=False)
+
+
+def _retry_after(headers):
+    value = headers.get('Retry-After') if headers else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        date = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, date.timestamp() - time.time())
+
+
+# 默认所有Client共享一个重试预算
+RETRY_POLICY = RetryPolicy()
+
+
+def get_retry_policy(retry=None):
+    """retry可以是RetryPolicy、重试次数、False(不重试)或None(默认策略)"""
+    if retry is None or retry is True:
+        return RETRY_POLICY
+    if retry is False:
+        return NoRetry()
+    if isinstance(retry, int):
+        return RetryPolicy(retries=retry, budget=RETRY_POLICY.budget)
+    return retry
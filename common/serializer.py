@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+请求体的序列化：直接从资源对象树生成json，不再先递归转换成dict。
+RestObject的公共字段(不以_开头、不可调用)按类型缓存，见Resource._public_fields
+"""
+import operator
+from json.encoder import encode_basestring_ascii
+
+# 按字段序列化的对象类型，由rancher注册RestObject，避免循环导入
+_OBJECT_TYPES = ()
+_END = object()
+_is_private = operator.methodcaller('startswith', '_')
+
+
+def register(cls):
+    global _OBJECT_TYPES
+    _OBJECT_TYPES = _OBJECT_TYPES + (cls,)
+
+
+def public_fields(obj):
+    # 字段布局未变化时直接使用类上缓存的公共字段
+    cls = type(obj)
+    d = obj.__dict__
+    fields = getattr(cls, '_public_fields', None)
+    if fields is not None and d.keys() == cls._field_set:
+        return fields
+    return [k for k in d if not k.startswith('_')]
+
+
+def _collection(d):
+    # type为collection的集合对象序列化为data列表
+    if d.get('type') == 'collection':
+        data = d.get('data')
+        if isinstance(data, list):
+            return data
+    return None
+
+
+def default(obj):
+    """
+    codec.dumps的default：RestObject返回字段dict，没有私有字段时直接返回实例的__dict__，不复制。
+    可调用的字段会再次进入default并抛出TypeError，由dumps回退到write过滤
+    """
+    if isinstance(obj, _OBJECT_TYPES):
+        d = obj.__dict__
+        if d.get('type') == 'collection':
+            data = _collection(d)
+            if data is not None:
+                return data
+        if not any(map(_is_private, d)):
+            return d
+        return {k: d[k] for k in public_fields(obj)}
+    raise TypeError('Object of type {} is not JSON serializable'.format(type(obj).__name__))
+
+
+def _container(obj):
+    # write/to_value使用的RestObject视图，过滤可调用的字段
+    d = obj.__dict__
+    data = _collection(d)
+    if data is not None:
+        return data
+    return {k: d[k] for k in public_fields(obj) if not callable(d[k])}
+
+
+def dumps(obj, codec, indent=None, sort_keys=False):
+    """
+    codec通过default直接序列化资源对象树；codec不支持(自定义codec、可调用的字段)
+    或嵌套层数超过codec的限制时，使用不递归的write
+    """
+    if indent is not None:
+        return codec.dumps(to_value(obj), indent=indent, sort_keys=sort_keys)
+    try:
+        return codec.dumps(obj, sort_keys=sort_keys, default=default)
+    except (TypeError, ValueError, RecursionError):
+        return write(obj, sort_keys)
+
+
+def write(obj, sort_keys=False):
+    """用显式的栈生成json，嵌套层数不受递归深度限制"""
+    out = []
+    append = out.append
+    stack = []
+    item = obj
+    while True:
+        if isinstance(item, _OBJECT_TYPES):
+            item = _container(item)
+        if isinstance(item, dict):
+            append('{')
+            items = item.items()
+            if sort_keys:
+                items = sorted(items, key=lambda kv: kv[0])
+            stack.append((iter(items), True))
+        elif isinstance(item, (list, tuple)):
+            append('[')
+            stack.append((iter(item), False))
+        else:
+            append(_scalar(item))
+
+        while stack:
+            it, is_dict = stack[-1]
+            nxt = next(it, _END)
+            if nxt is _END:
+                stack.pop()
+                append('}' if is_dict else ']')
+                continue
+            if out[-1] != '{' and out[-1] != '[':
+                append(',')
+            if is_dict:
+                k, item = nxt
+                append(_key(k))
+                append(':')
+            else:
+                item = nxt
+            break
+        else:
+            return ''.join(out)
+
+
+def _scalar(v):
+    if isinstance(v, str):
+        return encode_basestring_ascii(v)
+    if v is None:
+        return 'null'
+    if v is True:
+        return 'true'
+    if v is False:
+        return 'false'
+    if isinstance(v, int):
+        return int.__repr__(v)
+    if isinstance(v, float):
+        if v != v:
+            return 'NaN'
+        if v in (float('inf'), float('-inf')):
+            return 'Infinity' if v > 0 else '-Infinity'
+        return float.__repr__(v)
+    raise TypeError('Object of type {} is not JSON serializable'.format(type(v).__name__))
+
+
+def _key(k):
+    if isinstance(k, str):
+        return encode_basestring_ascii(k)
+    return '"' + _scalar(k).strip('"') + '"'
+
+
+def to_value(obj):
+    """转换为dict/list/标量组成的数据，用显式的栈代替递归"""
+    nested = (dict, list, tuple) + _OBJECT_TYPES
+    root = [obj]
+    stack = [(root, 0)]
+    while stack:
+        parent, key = stack.pop()
+        value = parent[key]
+        if isinstance(value, _OBJECT_TYPES):
+            value = _container(value)
+        if isinstance(value, dict):
+            ret = dict(value)
+            for k, v in ret.items():
+                if isinstance(v, nested):
+                    stack.append((ret, k))
+        elif isinstance(value, (list, tuple)):
+            ret = list(value)
+            for i, v in enumerate(ret):
+                if isinstance(v, nested):
+                    stack.append((ret, i))
+        else:
+            continue
+        parent[key] = ret
+    return root[0]
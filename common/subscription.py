@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import base64
+import collections
+import logging
+import ssl
+import threading
+import time
+
+try:
+    import websocket
+except ImportError:
+    websocket = None
+
+logger = logging.getLogger(__name__)
+
+# 订阅的事件
+EVENT_NAMES = ('resource.create', 'resource.change', 'resource.remove')
+RESOURCE_REMOVE = 'resource.remove'
+# 每个连接最多保存的资源数量，只保存每个资源最新的一次事件
+MAX_RESOURCES = 10000
+# websocket读超时，用于定期检查连接是否需要关闭
+RECV_TIMEOUT = 1
+# 断线重连的最大间隔
+MAX_RECONNECT_INTERVAL = 30
+
+Event = collections.namedtuple('Event', ['seq', 'name', 'obj'])
+
+
+class SubscriptionManager(object):
+    """
+    每个Client一个/v3/subscribe websocket连接，后台线程接收资源变化事件，
+    按(type, id)保存每个资源最新的事件并唤醒等待该资源的Watch。
+    连接断开时会自动重连，断开期间connected为False，等待方应回退到轮询。
+    """
+
+    def __init__(self, client, url=None, verify=None):
+        if websocket is None:
+            raise ImportError('websocket-client is required for subscriptions')
+        self._client = client
+        self.url = url or _subscribe_url(client)
+        self._verify = client._session.verify if verify is None else verify
+        self._cond = threading.Condition()
+        self._events = collections.OrderedDict()
+        self._seq = 0
+        self._closed = threading.Event()
+        self._ws = None
+        self.connected = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def close(self):
+        self._closed.set()
+        ws = self._ws
+        if ws is not None:
+            ws.close()
+        self._set_connected(False)
+
+    def watch(self, type, id):
+        return Watch(self, type, id)
+
+    def cursor(self):
+        with self._cond:
+            return self._seq
+
+    def wait(self, type, id, since, timeout):
+        """等待(type, id)在since之后的事件，超时或连接断开时返回None"""
+        key = (type, id)
+        deadline = time.time() + timeout
+        with self._cond:
+            while True:
+                event = self._events.get(key)
+                if event is not None and event.seq > since:
+                    return event
+                remaining = deadline - time.time()
+                if remaining <= 0 or not self.connected:
+                    return None
+                self._cond.wait(remaining)
+
+    def _set_connected(self, connected):
+        with self._cond:
+            self.connected = connected
+            self._cond.notify_all()
+
+    def _headers(self):
+        headers = ['{}: {}'.format(k, v)
+                   for k, v in self._client._headers.items()]
+        if self._client._auth is not None:
+            token = base64.b64encode(
+                ':'.join(self._client._auth).encode('utf-8')).decode('utf-8')
+            headers.append('Authorization: Basic ' + token)
+        return headers
+
+    def _connect(self):
+        sslopt = None
+        if self._verify is False:
+            sslopt = {'cert_reqs': ssl.CERT_NONE, 'check_hostname': False}
+        ws = websocket.create_connection(self.url, header=self._headers(),
+                                         sslopt=sslopt, timeout=RECV_TIMEOUT)
+        return ws
+
+    def _run(self):
+        interval = 1
+        while not self._closed.is_set():
+            try:
+                self._ws = self._connect()
+            except Exception as e:
+                logger.debug('subscribe {} failed: {}'.format(self.url, e))
+                self._closed.wait(interval)
+                interval = min(interval * 2, MAX_RECONNECT_INTERVAL)
+                continue
+
+            interval = 1
+            self._set_connected(True)
+            try:
+                while not self._closed.is_set():
+                    try:
+                        message = self._ws.recv()
+                    except websocket.WebSocketTimeoutException:
+                        continue
+                    if message:
+                        self._handle(message)
+            except Exception as e:
+                logger.debug('subscribe {} closed: {}'.format(self.url, e))
+            finally:
+                self._set_connected(False)
+                self._ws.close()
+                self._ws = None
+
+    def _handle(self, message):
+        try:
+            msg = self._client._codec.loads(message)
+        except ValueError:
+            return
+
+        name = msg.get('name')
+        data = msg.get('data')
+        if name not in EVENT_NAMES or not isinstance(data, dict):
+            return
+
+        obj = self._client.object_hook(data)
+        key = (data.get('type'), data.get('id'))
+        with self._cond:
+            self._seq += 1
+            self._events.pop(key, None)
+            self._events[key] = Event(self._seq, name, obj)
+            while len(self._events) > MAX_RESOURCES:
+                self._events.popitem(last=False)
+            self._cond.notify_all()
+
+
+class Watch(object):
+    """等待单个资源的变化，每次next只返回比上一次更新的事件"""
+
+    def __init__(self, manager, type, id):
+        self._manager = manager
+        self.type = type
+        self.id = id
+        self._seq = manager.cursor()
+
+    @property
+    def connected(self):
+        return self._manager.connected
+
+    def next(self, timeout):
+        event = self._manager.wait(self.type, self.id, self._seq, timeout)
+        if event is not None:
+            self._seq = event.seq
+        return event
+
+
+def _subscribe_url(client):
+    url = None
+    if client.schema is not None and 'subscribe' in client.schema.types:
+        url = client.schema.types['subscribe'].links.collection
+    if url is None:
+        url = client._url.rstrip('/') + '/subscribe'
+    if url.startswith('https://'):
+        url = 'wss://' + url[len('https://'):]
+    elif url.startswith('http://'):
+        url = 'ws://' + url[len('http://'):]
+    separator = '&' if '?' in url else '?'
+    return url + separator + '&'.join('eventNames=' + name for name in EVENT_NAMES)
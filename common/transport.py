@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+import threading
+import time
+
+import httpx
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from common import metrics
+
+# 连接池配置：pool_connections为缓存的host连接池数量，pool_maxsize为每个host保留的最大连接数
+POOL_CONNECTIONS = int(os.environ.get('RANCHER_POOL_CONNECTIONS') or 10)
+POOL_MAXSIZE = int(os.environ.get('RANCHER_POOL_MAXSIZE') or 32)
+# AsyncClient使用HTTP/2，需要安装h2
+HTTP2 = not os.environ.get('RANCHER_HTTP2') is None
+
+
+class TimedHTTPConnection(HTTPConnection):
+    # 记录新建连接的耗时，见common/metrics.py
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            super(TimedHTTPConnection, self).connect()
+        finally:
+            metrics.add_connect(time.perf_counter() - start)
+
+
+class TimedHTTPSConnection(HTTPSConnection):
+    # 包括TLS握手
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            super(TimedHTTPSConnection, self).connect()
+        finally:
+            metrics.add_connect(time.perf_counter() - start)
+
+
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+
+class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+
+class SharedAdapter(HTTPAdapter):
+    """
+    所有Client共享的HTTPAdapter，同一个host的连接(包括已完成TLS握手的连接)在Client之间复用。
+    HTTPAdapter在每次请求时按verify/cert修改连接池的证书配置，因此只在verify/cert相同的Client之间共享，
+    避免verify=False的Client关闭其他Client的证书校验。
+    Session.close不会关闭共享的连接池，需要时调用close_all
+    """
+
+    def __init__(self, pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE):
+        super(SharedAdapter, self).__init__(pool_connections=pool_connections,
+                                            pool_maxsize=pool_maxsize)
+
+    def init_poolmanager(self, *args, **kw):
+        super(SharedAdapter, self).init_poolmanager(*args, **kw)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': TimedHTTPConnectionPool,
+            'https': TimedHTTPSConnectionPool
+        }
+
+    def close(self):
+        pass
+
+    def close_pools(self):
+        super(SharedAdapter, self).close()
+
+    def pool_stats(self):
+        """每个host连接池的统计：created已创建的连接数，in_use使用中的连接数，idle空闲连接数"""
+        stats = []
+        pools = self.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None or pool.pool is None:
+                continue
+            slots = pool.pool
+            idle = sum(1 for conn in list(slots.queue) if conn is not None)
+            stats.append({
+                'scheme': pool.scheme,
+                'host': pool.host,
+                'port': pool.port,
+                'maxsize': slots.maxsize,
+                'created': pool.num_connections,
+                'in_use': max(0, slots.maxsize - slots.qsize()),
+                'idle': idle
+            })
+        return stats
+
+
+_ADAPTERS = {}
+_ADAPTERS_LOCK = threading.Lock()
+
+
+def get_adapter(pool_connections=None, pool_maxsize=None, verify=True, cert=None):
+    """相同连接池配置和证书配置(verify, cert)的Client共享同一个SharedAdapter"""
+    pool_connections = pool_connections or POOL_CONNECTIONS
+    pool_maxsize = pool_maxsize or POOL_MAXSIZE
+    if isinstance(cert, list):
+        cert = tuple(cert)
+    key = (pool_connections, pool_maxsize, verify, cert)
+    with _ADAPTERS_LOCK:
+        adapter = _ADAPTERS.get(key)
+        if adapter is None:
+            adapter = SharedAdapter(pool_connections, pool_maxsize)
+            _ADAPTERS[key] = adapter
+        return adapter
+
+
+def mount(session, pool_connections=None, pool_maxsize=None):
+    adapter = get_adapter(pool_connections, pool_maxsize, session.verify, session.cert)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def async_session(verify, pool_maxsize=None, http2=None):
+    """AsyncClient使用的httpx.AsyncClient，连接数与同步Client的连接池配置一致"""
+    pool_maxsize = pool_maxsize or POOL_MAXSIZE
+    limits = httpx.Limits(max_connections=pool_maxsize,
+                          max_keepalive_connections=pool_maxsize)
+    return httpx.AsyncClient(verify=verify, timeout=None, limits=limits,
+                             http2=HTTP2 if http2 is None else http2)
+
+
+def pool_stats():
+    stats = []
+    with _ADAPTERS_LOCK:
+        adapters = list(_ADAPTERS.values())
+    for adapter in adapters:
+        stats.extend(adapter.pool_stats())
+    return stats
+
+
+def close_all():
+    with _ADAPTERS_LOCK:
+        adapters = list(_ADAPTERS.values())
+        _ADAPTERS.clear()
+    for adapter in adapters:
+        adapter.close_pools()
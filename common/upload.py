@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+
+from requests_toolbelt import MultipartEncoder, MultipartEncoderMonitor
+
+# 流式上传时每次从文件读取的大小
+READ_SIZE = 1024 * 1024
+
+
+class UploadInterrupted(Exception):
+    """分块上传失败，offset为已经上传成功的字节数，可以通过upload_file(offset=e.offset)续传"""
+
+    def __init__(self, offset, cause):
+        super(UploadInterrupted, self).__init__(
+            'upload interrupted at offset {}: {}'.format(offset, cause))
+        self.offset = offset
+        self.cause = cause
+
+
+class FileSlice(object):
+    """
+    文件中[offset, offset + length)的只读视图，MultipartEncoder按需读取，不会整体读入内存
+    请求可能在读完之前失败，需要with FileSlice(...)使用或者显式close
+    """
+
+    def __init__(self, path, offset=0, length=None):
+        self.name = os.path.basename(path)
+        self.offset = offset
+        self._file = open(path, 'rb')
+        size = os.fstat(self._file.fileno()).st_size
+        self._file.seek(offset)
+        self._remaining = size - offset if length is None else min(length, size - offset)
+
+    @property
+    def len(self):
+        # MultipartEncoder按剩余长度判断是否读完
+        return self._remaining
+
+    def read(self, n=-1):
+        if not self._remaining:
+            return b''
+        if n is None or n < 0 or n > self._remaining:
+            n = self._remaining
+        data = self._file.read(n)
+        self._remaining -= len(data)
+        if not self._remaining:
+            self._file.close()
+        return data
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def encoder(part, field='file', fields=None, filename=None,
+            content_type='application/octet-stream', progress=None, total=None):
+    """
+    用FileSlice构造流式的multipart请求体，progress(已上传字节数, 文件总字节数)在发送过程中被调用
+    """
+    offset = part.offset
+    body = dict(fields or {})
+    body[field] = (filename or part.name, part, content_type)
+    multipart = MultipartEncoder(fields=body)
+    if progress is None:
+        return multipart
+    size = part.len
+    total = size if total is None else total
+
+    def callback(monitor):
+        sent = int(size * monitor.bytes_read / monitor.len) if monitor.len else size
+        progress(offset + sent, total)
+
+    return MultipartEncoderMonitor(multipart, callback)
+
+
+def chunks(size, chunk_size, offset=0):
+    """分块上传的(起始位置, 长度)"""
+    while offset < size:
+        yield offset, min(chunk_size, size - offset)
+        offset += chunk_size
+
+
+def content_range(offset, length, size):
+    return 'bytes {}-{}/{}'.format(offset, offset + length - 1, size)
+
+
+async def iter_async(body):
+    # httpx.AsyncClient需要异步迭代的请求体
+    while True:
+        data = body.read(READ_SIZE)
+        if not data:
+            return
+        yield data
@@ -6,9 +6,11 @@ import os
 import time
 import yaml
 import pytest
-import requests
 import urllib3
 from common import rancher
+from common import governor
+from common import cassette
+from common import metrics
 from common.comm import ARCH_AMD
 from common.comm import wait_until
 from common.rancher import ApiError
@@ -35,7 +37,9 @@ urllib3.disable_warnings()
 envs = get_envs()
 IP = os.environ.get("KM_IP") or envs.get("host", "")
 PORT = os.environ.get("RANCHER_PORT") or envs.get("port", "443")
-SERVER_URL = 'https://' + IP + ':' + str(PORT)
+# 使用本地的KM替身(common/fake_km.py)时设置KM_SCHEME=http
+SCHEME = os.environ.get("KM_SCHEME") or "https"
+SERVER_URL = SCHEME + '://' + IP + ':' + str(PORT)
 # SERVER_URL = 'https://' + IP
 BASE_URL = SERVER_URL + '/v3'
 AUTH_URL = BASE_URL + '-public/localproviders/local?action=login'
@@ -99,10 +103,12 @@ def kubernetes_api_client(rancher_client, cluster_name):
 def cluster_and_client(cluster_id, mgmt_client):
     cluster = mgmt_client.by_id_cluster(cluster_id)
     url = cluster.links.self
-    client = rancher.Client(url=url,
-                            verify=False,
-                            token=mgmt_client.token,
-                            headers={"Content-Type": "application/json"})
+    # 集群url在多次运行之间不变，开启磁盘schema缓存，多个worker共享
+    client = rancher.get_client(url=url,
+                                verify=False,
+                                token=mgmt_client.token,
+                                cache=True,
+                                headers={"Content-Type": "application/json"})
     return cluster, client
 
 
@@ -112,12 +118,13 @@ def admin_mc():
     username = envs.get("username", "admin")
     password = envs.get("password", "Admin@123")
     json = {"username": username, "password": password, "responseType": "json"}
-    r = requests.post(AUTH_URL, json=json, verify=False)
+    r = cassette.post(AUTH_URL, json=json, verify=False)
     protect_response(r)
-    client = rancher.Client(url=BASE_URL,
-                            token=r.json()['token'],
-                            verify=False,
-                            headers={"Content-Type": "application/json"})
+    client = rancher.get_client(url=BASE_URL,
+                                token=r.json()['token'],
+                                verify=False,
+                                cache=True,
+                                headers={"Content-Type": "application/json"})
     # k8s_client = kubernetes_api_client(client, 'local')
     k8s_client = None
     admin = client.list("user", username='admin').data[0]
@@ -248,6 +255,7 @@ def admin_pc_factory(admin_cc, remove_resource):
             admin_cc,
             project,
             namespace,
+            # 每个用例的项目url都不同，不经过get_client缓存，用例结束后Client随之回收
             rancher.Client(url=url, verify=False, token=admin_client.token,
                            headers={"Content-Type": "application/json"}))
 
@@ -280,8 +288,8 @@ def user_pc(user_cc, remove_resource_session):
         user_cc,
         project,
         namespace,
-        rancher.Client(url=url, verify=False, token=admin_client.token,
-                       headers={"Content-Type": "application/json"}))
+        rancher.get_client(url=url, verify=False, token=admin_client.token,
+                           headers={"Content-Type": "application/json"}))
 
 
 @pytest.fixture(scope="session")
@@ -304,8 +312,8 @@ def user_edge_pc(user_edge_cc, remove_resource_session):
         user_edge_cc,
         project,
         namespace,
-        rancher.Client(url=url, verify=False, token=admin_client.token,
-                       headers={"Content-Type": "application/json"}))
+        rancher.get_client(url=url, verify=False, token=admin_client.token,
+                           headers={"Content-Type": "application/json"}))
 
 
 @pytest.fixture(scope="session")
@@ -322,8 +330,8 @@ def user_sc(user_cc, admin_mc):
         user_cc,
         project,
         namespace,
-        rancher.Client(url=url, verify=False, token=admin_client.token,
-                       headers={"Content-Type": "application/json"}))
+        rancher.get_client(url=url, verify=False, token=admin_client.token,
+                           headers={"Content-Type": "application/json"}))
 
 
 @pytest.fixture(scope="session")
@@ -340,8 +348,8 @@ def user_edge_sc(user_edge_cc, admin_mc):
         user_edge_cc,
         project,
         namespace,
-        rancher.Client(url=url, verify=False, token=admin_client.token,
-                       headers={"Content-Type": "application/json"}))
+        rancher.get_client(url=url, verify=False, token=admin_client.token,
+                           headers={"Content-Type": "application/json"}))
 
 
 @pytest.fixture(scope="session")
@@ -358,8 +366,8 @@ def user_ai_pc(admin_mc, user_edge_cc):
         user_edge_cc,
         project,
         namespace,
-        rancher.Client(url=url, verify=False, token=admin_client.token,
-                       headers={"Content-Type": "application/json"}))
+        rancher.get_client(url=url, verify=False, token=admin_client.token,
+                           headers={"Content-Type": "application/json"}))
 
 
 @pytest.fixture(scope="session")
@@ -376,8 +384,23 @@ def user_default_pc(admin_mc, user_edge_cc):
         user_edge_cc,
         project,
         namespace,
-        rancher.Client(url=url, verify=False, token=admin_client.token,
-                       headers={"Content-Type": "application/json"}))
+        rancher.get_client(url=url, verify=False, token=admin_client.token,
+                           headers={"Content-Type": "application/json"}))
+
+
+def delete_in_order(client, resources, timeout=None):
+    """
+    按传入的顺序依次删除资源(例如先删除工作负载再删除命名空间)，资源已不存在时忽略，
+    timeout不为None时等待每个资源删除完成后再删除下一个
+    """
+    for resource in resources:
+        try:
+            client.delete(resource)
+        except ApiError as e:
+            if e.error.status != 404:
+                raise e
+        if timeout is not None:
+            wait_until(lambda: client.get(resource) is None, timeout)
 
 
 @pytest.fixture
@@ -388,16 +411,9 @@ def remove_resource(admin_mc, request):
     client = admin_mc.client
 
     def _cleanup(*resources):
-        def clean_resource(resource):
-            try:
-                client.delete(resource)
-            except ApiError as e:
-                if e.error.status != 404:
-                    raise e
-
         def clean():
-            for resource in resources:
-                clean_resource(resource)
+            with governor.low_priority():
+                delete_in_order(client, resources)
 
         request.addfinalizer(clean)
 
@@ -412,16 +428,9 @@ def remove_resource_session(admin_mc, request):
     client = admin_mc.client
 
     def _cleanup(*resources):
-        def clean_resource(resource):
-            try:
-                client.delete(resource)
-            except ApiError as e:
-                if e.error.status != 404:
-                    raise e
-
         def clean():
-            for resource in resources:
-                clean_resource(resource)
+            with governor.low_priority():
+                delete_in_order(client, resources)
 
         request.addfinalizer(clean)
 
@@ -436,16 +445,9 @@ def remove_resource_module(admin_mc, request):
     client = admin_mc.client
 
     def _cleanup(*resources):
-        def clean_resource(resource):
-            try:
-                client.delete(resource)
-            except ApiError as e:
-                if e.error.status != 404:
-                    raise e
-
         def clean():
-            for resource in resources:
-                clean_resource(resource)
+            with governor.low_priority():
+                delete_in_order(client, resources)
 
         request.addfinalizer(clean)
 
@@ -460,19 +462,9 @@ def wait_remove_resource(admin_mc, request, timeout=120):
     client = admin_mc.client
 
     def _cleanup(*resources):
-        def clean_resource(resource):
-            try:
-                client.delete(resource)
-            except ApiError as e:
-                if e.error.status != 404:
-                    raise e
-
-            # wait_until(lambda: client.reload(resource) is None, timeout)
-            wait_until(lambda: client.get(resource) is None, timeout)
-
         def clean():
-            for resource in resources:
-                clean_resource(resource)
+            with governor.low_priority():
+                delete_in_order(client, resources, timeout)
 
         request.addfinalizer(clean)
 
@@ -487,18 +479,9 @@ def wait_remove_resource_session(admin_mc, request, timeout=120):
     client = admin_mc.client
 
     def _cleanup(*resources):
-        def clean_resource(resource):
-            try:
-                client.delete(resource)
-            except ApiError as e:
-                if e.error.status != 404:
-                    raise e
-
-            wait_until(lambda: client.get(resource) is None, timeout)
-
         def clean():
-            for resource in resources:
-                clean_resource(resource)
+            with governor.low_priority():
+                delete_in_order(client, resources, timeout)
 
         request.addfinalizer(clean)
 
@@ -513,18 +496,9 @@ def wait_remove_resource_module(admin_mc, request, timeout=120):
     client = admin_mc.client
 
     def _cleanup(*resources):
-        def clean_resource(resource):
-            try:
-                client.delete(resource)
-            except ApiError as e:
-                if e.error.status != 404:
-                    raise e
-
-            wait_until(lambda: client.get(resource) is None, timeout)
-
         def clean():
-            for resource in resources:
-                clean_resource(resource)
+            with governor.low_priority():
+                delete_in_order(client, resources, timeout)
 
         request.addfinalizer(clean)
 
@@ -633,12 +607,13 @@ def user_factory(admin_mc, remove_resource, global_roleId="user"):
         grb = admin.create_global_role_binding(
             userId=user.id, globalRoleId=globalRoleId)
         remove_resource(grb)
-        response = requests.post(AUTH_URL, json={
+        response = cassette.post(AUTH_URL, json={
             'username': username,
             'password': password,
             'responseType': 'json',
         }, verify=False)
         protect_response(response)
+        # 每个新用户的token都不同，不经过get_client缓存
         client = rancher.Client(url=BASE_URL, token=response.json()['token'],
                                 verify=False,
                                 headers={"Content-Type": "application/json"})
@@ -700,6 +675,11 @@ def pytest_terminal_summary(terminalreporter, exitstatus, config):
         fp.write("TOTAL_TIMES=%.2fs" % duration)
     """
 
+    # 占用时间最多的KM接口，xdist时见各worker的reports/api_metrics_<worker>.json
+    if not metrics.SESSION.empty():
+        terminalreporter.write_sep("-", "KM API metrics")
+        terminalreporter.write_line(metrics.format_summary(metrics.SESSION.summary()))
+
     totp = config.option.totp
     if totp:
         exec_path = os.getcwd()  # 执行测试用例的当前路径
@@ -721,6 +701,43 @@ def pytest_terminal_summary(terminalreporter, exitstatus, config):
             time.sleep(2)
 
 
+@pytest.fixture(scope="session", autouse=True)
+def api_governor(tmp_path_factory):
+    """
+    所有worker共享的KM接口限速，通过RANCHER_RATE_LIMIT/RANCHER_MAX_IN_FLIGHT开启，
+    例如：RANCHER_RATE_LIMIT=lists=20,writes=10,actions=5 RANCHER_MAX_IN_FLIGHT=lists=8
+    """
+    # 获取所有子节点共享的临时目录
+    root_tmp_dir = tmp_path_factory.getbasetemp().parent
+    return governor.configure(root_tmp_dir / "rancher_governor.json")
+
+
+@pytest.fixture(scope="session", autouse=True)
+def api_metrics():
+    """
+    会话级的KM接口耗时统计，结束时写入reports/api_metrics.json(xdist时每个worker一个文件)并添加到allure报告，
+    每个用例的统计见api_metrics_per_test
+    """
+    tests = {}
+    yield tests
+    summary = metrics.SESSION.summary()
+    summary["tests"] = tests
+    worker = os.environ.get("PYTEST_XDIST_WORKER")
+    name = "api_metrics_{}.json".format(worker) if worker else "api_metrics.json"
+    metrics.write_json(os.path.join("reports", name), summary)
+    metrics.attach("api metrics (session)", metrics.SESSION.summary())
+
+
+@pytest.fixture(autouse=True)
+def api_metrics_per_test(request, api_metrics):
+    with metrics.collect() as registry:
+        yield registry
+    if not registry.empty():
+        summary = registry.summary()
+        api_metrics[request.node.nodeid] = summary
+        metrics.attach("api metrics", summary)
+
+
 @pytest.fixture(scope="session", autouse=True)
 def filter_warnings():
     import warnings